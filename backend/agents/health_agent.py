@@ -5,6 +5,7 @@ All records are scoped to the resolved patient_id.
 """
 import os
 import sys
+import asyncio
 from typing import Any, Dict, Optional
 from supabase import create_client, Client
 
@@ -62,7 +63,7 @@ class HealthAgent(BaseAgent):
         if action == "analyze":
             try:
                 records = await self.rag.get_patient_records(user_id)
-                result  = analyze_risk(records)
+                result  = await asyncio.to_thread(analyze_risk, records)
             except Exception as e:
                 return AgentResult(success=False, agent_name=self.name,
                                    message=f"Health analysis failed: {e}")
@@ -215,24 +215,29 @@ class PharmacistOrchestratorAgent:
         session_id = "pharmacist_global_session"
         history = self._get_history(session_id)
         
-        history_block = "\n--- CONVERSATION HISTORY ---\n"
-        for msg in reversed(history[-self.MAX_HISTORY_TURNS * 2:]):
-            history_block += f"{msg['role'].capitalize()}: {msg['content'][:300]}\n"
-        history_block += "----------------------------\n"
+        history_lines = "".join(
+            f"{msg['role'].capitalize()}: {msg['content'][:300]}\n"
+            for msg in reversed(history[-self.MAX_HISTORY_TURNS * 2:])
+        )
+        history_block = f"\n--- CONVERSATION HISTORY ---\n{history_lines}----------------------------\n"
         
         # Inject standard global snapshot (to minimize SQL overhead for simple things)
-        inventory_res = await asyncio.to_thread(self.db.table("medicines").select("name, stock").execute)
-        orders_res = await asyncio.to_thread(self.db.table("orders").select("status").execute)
-        
-        inv = inventory_res.data or []
-        ord = orders_res.data or []
-        pending = len([o for o in ord if o["status"] == "pending"])
+        # Counts are aggregated in Postgres (one RPC) rather than pulling whole tables
+        snapshot_res = await asyncio.to_thread(self.db.rpc("get_pharmacy_snapshot").execute)
+        snapshot = snapshot_res.data or {}
+        # Only the 20 most critical low-stock items; anything else is one tool call away
+        low_stock_lines = "".join(
+            f"- {m['name']}: {m['stock']} left (threshold {m['threshold']})\n"
+            for m in snapshot.get('low_stock') or []
+        ) or "- none\n"
         
         full_prompt = (
             f"{SYSTEM_PROMPT}\n\n"
             f"[Live Simple Summary Cache]\n"
-            f"Total Inventory Items: {len(inv)}\n"
-            f"Total Pending Orders: {pending}\n\n"
+            f"Inventory: {snapshot.get('inventory_count', 0)} SKUs, {snapshot.get('low_stock_count', 0)} below threshold\n"
+            f"Total Pending Orders: {snapshot.get('pending_count', 0)}\n"
+            f"Total Revenue (order history): €{float(snapshot.get('total_revenue') or 0):,.2f}\n"
+            f"Most Critical Low Stock:\n{low_stock_lines}\n"
             f"IMPORTANT INSTRUCTION: The user has selected the language code '{language}'. "
             f"You MUST read the user's query and provide your ENTIRE final response strictly in the requested language "
             f"('{language}'). If '{language}' is 'hi', speak in Hindi. If '{language}' is 'mr', speak in Marathi. If '{language}' is 'en', speak in English.\n"
@@ -23,6 +23,7 @@ class PharmacyAgent(BaseAgent):
         url = os.getenv("VITE_SUPABASE_URL")
         key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
         self.db: Client = create_client(url, key)
+        self.model = genai.GenerativeModel("gemini-2.5-flash")
         self.prescription_agent = PrescriptionAgent()
 
     # ------------------------------------------------------------------
@@ -91,8 +92,7 @@ class PharmacyAgent(BaseAgent):
         {combined_text}
         """
         try:
-            model = genai.GenerativeModel("gemini-2.5-flash")
-            response = model.generate_content(prompt)
+            response = self.model.generate_content(prompt)
             raw = response.text.strip()
             if raw.startswith("```json"):
                 raw = raw[7:-3].strip()
@@ -126,8 +126,7 @@ class PharmacyAgent(BaseAgent):
         JSON OUTPUT MUST STRICTLY BE A VALID ARRAY e.g. [{{"medicine_name": "Panadol", "qty": 10, "frequency_per_day": 3, "dosage_text": "after meals"}}]
         """
         try:
-            model = genai.GenerativeModel("gemini-2.5-flash")
-            response = model.generate_content(prompt)
+            response = self.model.generate_content(prompt)
             raw = response.text.strip()
             if raw.startswith("```json"):
                 raw = raw[7:-3].strip()
@@ -23,6 +23,7 @@ class PrescriptionAgent(BaseAgent):
         key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
         self.db: Client = create_client(url, key)
         genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+        self.model = genai.GenerativeModel("gemini-2.5-flash")
 
     def _resolve_patient_id(self, user_id: str) -> Optional[str]:
         res = (
@@ -46,11 +47,13 @@ class PrescriptionAgent(BaseAgent):
         return res.data or []
 
     @observe()
-    def verify_and_extract(self, medicine_name: str, patient_id: str) -> Dict[str, Any]:
+    def verify_and_extract(self, medicine_name: str, patient_id: str, records: Optional[List[Dict]] = None) -> Dict[str, Any]:
         """
         Check existing prescriptions and extract amount/timing using Gemini.
+        Pass `records` to reuse prescriptions already fetched for this patient.
         """
-        records = self.get_prescriptions(patient_id)
+        if records is None:
+            records = self.get_prescriptions(patient_id)
         if not records:
             return {
                 "verified": False,
@@ -87,8 +90,7 @@ class PrescriptionAgent(BaseAgent):
         {combined_text}
         """
         try:
-            model = genai.GenerativeModel("gemini-2.5-flash")
-            response = model.generate_content(prompt)
+            response = self.model.generate_content(prompt)
             raw = response.text.strip()
             if raw.startswith("```json"):
                 raw = raw[7:-3].strip()
@@ -106,12 +108,15 @@ class PrescriptionAgent(BaseAgent):
           user_id       — auth UID
           medicine_name — name of medicine to check
           action        — "verify" (default)
+        optional (lets batch callers skip per-medicine lookups):
+          patient_id    — already-resolved patients.id
+          prescriptions — records from get_prescriptions(patient_id)
         """
         user_id = context.get("user_id")
         medicine_name = context.get("medicine_name", task)
         action = context.get("action", "verify")
 
-        patient_id = self._resolve_patient_id(user_id) if user_id else None
+        patient_id = context.get("patient_id") or (self._resolve_patient_id(user_id) if user_id else None)
         if not patient_id:
             return AgentResult(success=False, agent_name=self.name, message="Patient not found.")
 
@@ -124,7 +129,7 @@ class PrescriptionAgent(BaseAgent):
             return AgentResult(success=True, data={"verified": True, "rx_required": False}, agent_name=self.name, message=f"{medicine_name} does not require a prescription.")
 
         # Perform verification
-        result = self.verify_and_extract(medicine_name, patient_id)
+        result = self.verify_and_extract(medicine_name, patient_id, context.get("prescriptions"))
         
         if not result.get("verified"):
             return AgentResult(
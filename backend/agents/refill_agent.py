@@ -42,6 +42,9 @@ class RefillAgent(BaseAgent):
             .select("finalized_at, order_items(medicine_id, qty, days_supply, medicines(name, stock))")
             .eq("patient_id", patient_id)
             .eq("status", "finalized")
+            .not_.is_("finalized_at", "null")  # DESC puts NULLs first; keep them out of the window
+            .order("finalized_at", desc=True)
+            .limit(200)
             .execute()
         )
         for order in (res.data or []):
@@ -4,7 +4,6 @@ import google.generativeai as genai
 import os
 import requests 
 import io
-import PyPDF2
 from supabase import create_client, Client
 from ml_engine import analyze_risk
 from langfuse.decorators import observe
@@ -1,24 +1,37 @@
 from fastapi import FastAPI, HTTPException, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
 import os
-import io
 import time
-import json
+import base64
+import asyncio
+import re
+import orjson
+import hashlib
+import functools
+import threading
+import multiprocessing
+from datetime import date, timedelta
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from cachetools import TTLCache
 from dotenv import load_dotenv
 
 # ── Load .env FIRST before anything else reads env vars ──────────────────────
 load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env'))
 load_dotenv(os.path.join(os.path.dirname(__file__), '.env'))  # also load local backend/.env if present
 
+import asyncpg
+import redis
 import stripe
 stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
 print(f"Stripe key loaded: {'YES (sk_test_...)' if stripe.api_key and stripe.api_key.startswith('sk_') else 'NO - MISSING!'}")
 
 from google.generativeai.types import HarmCategory, HarmBlockThreshold
 import google.generativeai as genai
+from google.generativeai import caching
 
 from voice_service import VoiceService
 from rag_service import RAGService
@@ -27,7 +40,11 @@ from ml_engine import analyze_risk, parse_medical_text
 from langfuse.decorators import observe
 
 # Initialize FastAPI
-app = FastAPI(title="Healthcare AI Assistant", version="2.0.0")
+app = FastAPI(
+    title="Healthcare AI Assistant",
+    version="2.0.0",
+    default_response_class=ORJSONResponse,
+)
 
 PORT = int(os.getenv("PORT", 8080))
 
@@ -45,7 +62,8 @@ app.add_middleware(
 
 # Initialize Gemini Model
 gemini_model = genai.GenerativeModel('gemini-2.5-flash')
-chat_sessions = {}
+# In-process chat history fallback when Redis is not configured (LRU over users)
+chat_sessions: "OrderedDict[str, deque]" = OrderedDict()
 
 voice_service = VoiceService(api_key=os.getenv("ELEVENLABS_API_KEY"))
 rag_service = RAGService(
@@ -119,12 +137,175 @@ class OutboundCallRequest(BaseModel):
 # ==========================================
 
 # ---- Medicine / Order helper (shared Supabase client) ----
+_SUPABASE_URL = os.getenv("VITE_SUPABASE_URL")
+_SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+
+@functools.lru_cache(maxsize=1)
 def _get_sb():
+    """Process-wide Supabase client, created on first use and reused after."""
     from supabase import create_client
-    return create_client(
-        os.getenv("VITE_SUPABASE_URL"),
-        os.getenv("SUPABASE_SERVICE_ROLE_KEY"),
-    )
+    return create_client(_SUPABASE_URL, _SUPABASE_SERVICE_KEY)
+
+async def _exec(query):
+    """Run a blocking supabase-py query in a worker thread so the event loop keeps serving."""
+    return await asyncio.to_thread(query.execute)
+
+_AUDIO_INLINE_ENCODE_MAX = 256 * 1024   # bigger clips are base64-encoded in a worker thread
+
+async def _encode_audio(audio_bytes: bytes) -> str:
+    """Base64-encode synthesized audio for a JSON response."""
+    if len(audio_bytes) > _AUDIO_INLINE_ENCODE_MAX:
+        encoded = await asyncio.to_thread(base64.b64encode, audio_bytes)
+    else:
+        encoded = base64.b64encode(audio_bytes)
+    return encoded.decode("ascii")
+
+# ---- Redis cache helper (optional: disabled when REDIS_URL is unset) ----
+@functools.lru_cache(maxsize=1)
+def _get_redis():
+    """Process-wide Redis client, or None if REDIS_URL is not configured."""
+    url = os.getenv("REDIS_URL")
+    if not url:
+        return None
+    return redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+
+# The redis client is synchronous: every call below runs in a worker thread so a
+# slow or unreachable Redis (up to the 0.5s socket timeout) never blocks the event loop.
+async def _cache_get_json(key: str):
+    """Return the cached JSON value for key, or None on miss / Redis error."""
+    r = _get_redis()
+    if r is None:
+        return None
+    try:
+        raw = await asyncio.to_thread(r.get, key)
+    except redis.RedisError as e:
+        print(f"⚠️ Redis get failed for {key}: {e}")
+        return None
+    return orjson.loads(raw) if raw is not None else None
+
+async def _cache_set_json(key: str, value, ttl: int, index: str) -> None:
+    """
+    Store value as JSON under key for ttl seconds and record key in the index
+    set, so _cache_delete_index can drop the group without a keyspace scan.
+    Redis errors are ignored.
+    """
+    r = _get_redis()
+    if r is None:
+        return
+    pipe = r.pipeline()
+    pipe.setex(key, ttl, orjson.dumps(value))
+    pipe.sadd(index, key)
+    pipe.expire(index, ttl)   # members expire by then anyway
+    try:
+        await asyncio.to_thread(pipe.execute)
+    except redis.RedisError as e:
+        print(f"⚠️ Redis set failed for {key}: {e}")
+
+async def _cache_delete_index(index: str) -> None:
+    """Delete every key recorded in the index set, and the set itself; Redis errors are ignored."""
+    r = _get_redis()
+    if r is None:
+        return
+
+    def _delete_members():
+        keys = r.smembers(index)
+        r.delete(index, *keys)
+
+    try:
+        await asyncio.to_thread(_delete_members)
+    except redis.RedisError as e:
+        print(f"⚠️ Redis delete failed for {index}: {e}")
+
+_MEDICINES_CACHE_TTL_S = 120
+_MEDICINES_CACHE_INDEX = "meds-keys"
+_RX_CACHE_TTL_S = 600
+
+# ---- PostgREST column lists shared by the routes below ----
+_CABINET_MEDICINE_COLS = "id,name,strength,unit_type,prescription_required,price_rec"
+_CABINET_ORDER_COLS = (
+    "id,status,total_items,channel,created_at,finalized_at,"
+    "order_items(id,qty,dosage_text,frequency_per_day,days_supply,"
+    f"medicines({_CABINET_MEDICINE_COLS}))"
+)
+_CATALOGUE_COLS = "id,name,strength,unit_type,stock,prescription_required,price_rec,description"
+_ORDERABLE_MEDICINE_COLS = "id,name,stock,prescription_required"
+_DUE_DOSE_COLS = (
+    "id,qty,frequency_per_day,dosage_text,medicines(name),"
+    "orders!inner(status,patients!inner(user_id))"
+)
+
+# ---- Direct Postgres pool (optional: created in lifespan when DATABASE_URL is set) ----
+_pg_pool: Optional[asyncpg.Pool] = None
+
+async def _init_pg_connection(conn) -> None:
+    # Decode json/jsonb columns into Python objects, like PostgREST does
+    for typ in ("json", "jsonb"):
+        await conn.set_type_codec(
+            typ, encoder=lambda v: orjson.dumps(v).decode(), decoder=orjson.loads, schema="pg_catalog"
+        )
+
+async def _create_pg_pool() -> Optional[asyncpg.Pool]:
+    dsn = os.getenv("DATABASE_URL")
+    if not dsn:
+        return None
+    try:
+        # statement_cache_size=0: the Supabase pooler (Supavisor, port 6543) runs in
+        # transaction mode, where server-side prepared statements are not safe
+        pool = await asyncpg.create_pool(
+            dsn, min_size=1, max_size=10, statement_cache_size=0, init=_init_pg_connection
+        )
+        print("✅ Postgres pool ready")
+        return pool
+    except Exception as e:
+        print(f"⚠️ Could not create Postgres pool, using Supabase HTTP only: {e}")
+        return None
+
+_MY_MEDICINES_SQL = """
+select o.id, o.status, o.total_items, o.channel, o.created_at, o.finalized_at,
+       coalesce(
+         json_agg(json_build_object(
+           'id', oi.id, 'qty', oi.qty, 'dosage_text', oi.dosage_text,
+           'frequency_per_day', oi.frequency_per_day, 'days_supply', oi.days_supply,
+           'created_at', o.created_at,
+           'medicines', case when m.id is null then null else json_build_object(
+             'id', m.id, 'name', m.name, 'strength', m.strength, 'unit_type', m.unit_type,
+             'prescription_required', m.prescription_required, 'price_rec', m.price_rec)
+           end
+         )) filter (where oi.id is not null),
+         '[]'::json
+       ) as items
+from orders o
+left join order_items oi on oi.order_id = o.id
+left join medicines m on m.id = oi.medicine_id
+where o.patient_id = $1
+group by o.id
+order by o.created_at desc
+"""
+
+# Rows come back as one json_agg value, so column types match what PostgREST returns
+_CATALOGUE_SQL = """
+select coalesce(json_agg(t), '[]'::json) from (
+  select id, name, strength, unit_type, stock, prescription_required, price_rec, description
+  from medicines
+  where stock > 0 and ($1 = '' or name ilike '%' || $1 || '%')
+  limit $2
+) t
+"""
+
+_DUE_DOSES_SQL = """
+select coalesce(json_agg(t), '[]'::json) from (
+  select oi.id, oi.qty, oi.frequency_per_day, oi.dosage_text,
+         case when m.id is null then null else json_build_object('name', m.name) end as medicines
+  from order_items oi
+  join orders o on o.id = oi.order_id
+  join patients p on p.id = o.patient_id
+  left join medicines m on m.id = oi.medicine_id
+  where p.user_id = $1
+    and o.status in ('fulfilled', 'approved')
+    and oi.frequency_per_day is not null
+    and oi.qty > 0
+) t
+"""
 
 @app.get("/my-medicines")
 async def get_my_medicines(patient_id: str):
@@ -136,37 +317,35 @@ async def get_my_medicines(patient_id: str):
     resolved to patients.id.
     """
     try:
+        if _pg_pool is not None:
+            async with _pg_pool.acquire() as conn:
+                pid = await conn.fetchval("select id from patients where user_id = $1", patient_id)
+                if pid is None:
+                    raise HTTPException(status_code=404, detail="Patient not found")
+                rows = await conn.fetch(_MY_MEDICINES_SQL, pid)
+            return {"success": True, "orders": [dict(r) for r in rows]}
+
         sb = _get_sb()
         # Resolve auth uid → patients.id
-        pt = sb.table("patients").select("id").eq("user_id", patient_id).single().execute()
+        pt = await _exec(sb.table("patients").select("id").eq("user_id", patient_id).single())
         if not pt.data:
             raise HTTPException(status_code=404, detail="Patient not found")
         pid = pt.data["id"]
 
-        # Fetch all orders for this patient (finalized + pending)
-        orders_res = (
+        # Fetch all orders for this patient (finalized + pending) with their
+        # items and medicines embedded — one round trip for the whole cabinet
+        orders_res = await _exec(
             sb.table("orders")
-            .select("id,status,total_items,channel,created_at,finalized_at")
+            .select(_CABINET_ORDER_COLS)
             .eq("patient_id", pid)
             .order("created_at", desc=True)
-            .execute()
         )
         orders = orders_res.data or []
 
         enriched = []
         for order in orders:
-            items_res = (
-                sb.table("order_items")
-                .select(
-                    "id,qty,dosage_text,frequency_per_day,days_supply,"
-                    "medicines(id,name,strength,unit_type,prescription_required,price_rec)"
-                )
-                .eq("order_id", order["id"])
-                .execute()
-            )
-            
             # Inject created_at down into items for frontend schedule calculation
-            items = items_res.data or []
+            items = order.pop("order_items", None) or []
             for item in items:
                 item["created_at"] = order.get("created_at")
                 
@@ -184,14 +363,25 @@ async def get_my_medicines(patient_id: str):
 async def get_available_medicines(search: str = "", limit: int = 50):
     """Return medicines catalogue with stock > 0, optionally filtered by name."""
     try:
-        sb = _get_sb()
-        q = sb.table("medicines").select(
-            "id,name,strength,unit_type,stock,prescription_required,price_rec,description"
-        ).gt("stock", 0).limit(limit)
-        if search:
-            q = q.ilike("name", f"%{search}%")
-        res = q.execute()
-        return {"success": True, "medicines": res.data or []}
+        # The catalogue changes rarely but this is hit on every search keystroke
+        # One normalized term for the key and the query (ILIKE ignores case, so the key can too)
+        term = search.strip()
+        cache_key = f"meds:{term.lower()}:{limit}"
+        cached = await _cache_get_json(cache_key)
+        if cached is not None:
+            return {"success": True, "medicines": cached}
+
+        if _pg_pool is not None:
+            medicines = await _pg_pool.fetchval(_CATALOGUE_SQL, term, limit)
+        else:
+            sb = _get_sb()
+            q = sb.table("medicines").select(_CATALOGUE_COLS).gt("stock", 0).limit(limit)
+            if term:
+                q = q.ilike("name", f"%{term}%")
+            res = await _exec(q)
+            medicines = res.data or []
+        await _cache_set_json(cache_key, medicines, _MEDICINES_CACHE_TTL_S, _MEDICINES_CACHE_INDEX)
+        return {"success": True, "medicines": medicines}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -201,12 +391,12 @@ async def manual_order(request: ManualOrderRequest):
     """
     Create and finalize a manual order for a patient.
     Checks stock availability and prescription requirement.
-    Decrements stock via decrement_medicine_stock RPC.
+    Creates the order and decrements stock via the create_manual_order RPC.
     """
     try:
         sb = _get_sb()
         # Resolve auth uid → patients.id
-        pt = sb.table("patients").select("id").eq("user_id", request.patient_id).single().execute()
+        pt = await _exec(sb.table("patients").select("id").eq("user_id", request.patient_id).single())
         if not pt.data:
             raise HTTPException(status_code=404, detail="Patient not found")
         pid = pt.data["id"]
@@ -214,26 +404,39 @@ async def manual_order(request: ManualOrderRequest):
         errors = []
         valid_items = []
 
+        # One round trip for every requested medicine instead of one per item
+        med_ids = [item.get("medicine_id") for item in request.items if item.get("medicine_id")]
+        meds_by_id = {}
+        if med_ids:
+            meds_res = await _exec(
+                sb.table("medicines").select(_ORDERABLE_MEDICINE_COLS).in_("id", med_ids)
+            )
+            meds_by_id = {m["id"]: m for m in meds_res.data or []}
+
+        # Prescription records are loaded once, on the first item that needs them
+        rx_agent = None
+        prescriptions = None
+
         for item in request.items:
             med_id = item.get("medicine_id")
             qty = max(1, int(item.get("qty", 1)))
             freq = item.get("frequency_per_day")
             dosage = item.get("dosage_text", "As directed")
 
-            med = sb.table("medicines").select(
-                "id,name,stock,prescription_required"
-            ).eq("id", med_id).single().execute()
-
-            if not med.data:
+            m = meds_by_id.get(med_id)
+            if not m:
                 errors.append(f"Medicine {med_id} not found")
                 continue
-            m = med.data
 
             if m["prescription_required"]:
-                from agents.prescription_agent import PrescriptionAgent
-                rx_agent = PrescriptionAgent()
+                if rx_agent is None:
+                    from agents.prescription_agent import PrescriptionAgent
+                    rx_agent = PrescriptionAgent()
+                    prescriptions = await asyncio.to_thread(rx_agent.get_prescriptions, pid)
                 rx_result = await rx_agent.run(m["name"], {
                     "user_id": request.patient_id,
+                    "patient_id": pid,
+                    "prescriptions": prescriptions,
                     "medicine_name": m["name"],
                     "action": "verify"
                 })
@@ -257,41 +460,23 @@ async def manual_order(request: ManualOrderRequest):
         if not valid_items:
             return {"success": False, "error": "; ".join(errors) if errors else "No valid items"}
 
-        # Create order with status 'pending' (valid per CHECK constraint)
-        order_res = sb.table("orders").insert({
-            "patient_id": pid,
-            "status": "pending",
-            "total_items": sum(i["qty"] for i in valid_items),
-            "channel": "web",
-        }).execute()
-        order_id = order_res.data[0]["id"]
-
-        # Insert order_items
-        for i in valid_items:
-            sb.table("order_items").insert({
-                "order_id": order_id,
-                "medicine_id": i["med"]["id"],
-                "qty": i["qty"],
-                "dosage_text": i["dosage"],
-                "frequency_per_day": i["freq"],
-                "days_supply": 30,
-            }).execute()
-
-        # Decrement stock and mark as fulfilled immediately
-        for i in valid_items:
-            try:
-                sb.rpc("decrement_medicine_stock", {
-                    "p_medicine_id": i["med"]["id"],
-                    "p_qty": i["qty"],
-                }).execute()
-            except Exception:
-                pass
-
-        from datetime import datetime, timezone
-        sb.table("orders").update({
-            "status": "fulfilled",
-            "finalized_at": datetime.now(timezone.utc).isoformat(),
-        }).eq("id", order_id).execute()
+        # Create the order, its items, the stock decrement and the fulfilment
+        # in one transactional RPC
+        order_res = await _exec(sb.rpc("create_manual_order", {
+            "p_patient_id": pid,
+            "p_items": [
+                {
+                    "medicine_id": i["med"]["id"],
+                    "qty": i["qty"],
+                    "dosage_text": i["dosage"],
+                    "frequency_per_day": i["freq"],
+                }
+                for i in valid_items
+            ],
+        }))
+        order_id = order_res.data
+        # Stock changed: sold-out medicines must drop out of /available-medicines now
+        await _cache_delete_index(_MEDICINES_CACHE_INDEX)
 
         return {
             "success": True,
@@ -313,11 +498,10 @@ async def voice_order(request: VoiceOrderRequest):
     try:
         sb = _get_sb()
         # 1. Search for medicine by name
-        search_res = (
+        search_res = await _exec(
             sb.table("medicines")
-            .select("id, name, stock, prescription_required")
+            .select(_ORDERABLE_MEDICINE_COLS)
             .ilike("name", f"%{request.medicine_name}%")
-            .execute()
         )
         if not search_res.data:
             return {"success": False, "error": f"Medicine '{request.medicine_name}' not found in catalog."}
@@ -398,7 +582,7 @@ async def get_available_medicines():
     """
     try:
         sb = _get_sb()
-        res = sb.table("medicines").select("id, name, stock, price, category").gt("stock", 0).execute()
+        res = await _exec(sb.table("medicines").select("id, name, stock, price, category").gt("stock", 0))
         return {"success": True, "medicines": res.data or []}
     except Exception as e:
         return {"success": False, "error": str(e)}
@@ -410,12 +594,11 @@ async def _create_stripe_checkout(order_id: str, success_url: str, cancel_url: s
     """
     sb = _get_sb()
     # Fetch order details
-    order_res = (
+    order_res = await _exec(
         sb.table("orders")
         .select("id, status, order_items(qty, medicines(name, price_rec))")
         .eq("id", order_id)
         .single()
-        .execute()
     )
     if not order_res.data:
         raise HTTPException(status_code=404, detail="Order not found")
@@ -481,14 +664,13 @@ async def voice_pay_link(patient_id: str):
     try:
         sb = _get_sb()
         # Find latest pending order for this patient
-        order_res = (
+        order_res = await _exec(
             sb.table("orders")
             .select("id")
             .eq("patient_id", patient_id)
             .eq("status", "pending")
             .order("created_at", desc=True)
             .limit(1)
-            .execute()
         )
         
         if not order_res.data:
@@ -509,7 +691,7 @@ async def voice_pay_link(patient_id: str):
         if result.get("success"):
             # Also log a notification so the user sees it in the app
             try:
-                sb.table("notification_logs").insert({
+                await _exec(sb.table("notification_logs").insert({
                     "patient_id": patient_id,
                     "channel": "app",
                     "type": "payment_request",
@@ -519,7 +701,7 @@ async def voice_pay_link(patient_id: str):
                         "message": "Payment link generated via voice assistant."
                     },
                     "status": "sent"
-                }).execute()
+                }))
             except Exception as ne:
                 print(f"⚠️ Could not log payment notification: {ne}")
             
@@ -565,12 +747,11 @@ async def verify_payment(request: VerifyPaymentRequest):
         print(f"Verify: Fulfilling order {order_id} for session {request.session_id}")
 
         # Fetch the order
-        order_res = (
+        order_res = await _exec(
             sb.table("orders")
             .select("status, order_items(medicine_id, qty)")
             .eq("id", order_id)
             .single()
-            .execute()
         )
         if not order_res.data:
             return {"success": False, "error": f"Order {order_id} not found"}
@@ -578,22 +759,24 @@ async def verify_payment(request: VerifyPaymentRequest):
         if order_res.data["status"] == "fulfilled":
             return {"success": True, "message": "Order already fulfilled — your medicines are on the way! ✅"}
 
-        # Decrement stock for each item
-        for item in order_res.data["order_items"]:
-            try:
-                sb.rpc("decrement_medicine_stock", {
-                    "p_medicine_id": item["medicine_id"],
-                    "p_qty": item["qty"],
-                }).execute()
-            except Exception as de:
-                print(f"Stock decrement warn: {de}")
+        # Decrement stock for all items in one batched RPC
+        try:
+            await _exec(sb.rpc("decrement_medicine_stocks", {
+                "p_items": [
+                    {"id": item["medicine_id"], "qty": item["qty"]}
+                    for item in order_res.data["order_items"]
+                ],
+            }))
+            await _cache_delete_index(_MEDICINES_CACHE_INDEX)
+        except Exception as de:
+            print(f"Stock decrement warn: {de}")
 
         # Mark order as fulfilled
         from datetime import datetime, timezone
-        sb.table("orders").update({
+        await _exec(sb.table("orders").update({
             "status": "fulfilled",
             "finalized_at": datetime.now(timezone.utc).isoformat(),
-        }).eq("id", order_id).execute()
+        }).eq("id", order_id))
 
         return {"success": True, "message": "Payment confirmed! Your order is being prepared. ✅"}
 
@@ -610,22 +793,28 @@ async def check_rx(patient_id: str, medicine_name: str):
     Returns {has_prescription: bool}.
     """
     try:
+        # Called before every order; only changes when a prescription is added
+        cache_key = f"rx:{patient_id}:{medicine_name.lower()}"
+        cached = await _cache_get_json(cache_key)
+        if cached is not None:
+            return {"has_prescription": cached}
+
         sb = _get_sb()
-        pt = sb.table("patients").select("id").eq("user_id", patient_id).single().execute()
+        pt = await _exec(sb.table("patients").select("id").eq("user_id", patient_id).single())
         if not pt.data:
             return {"has_prescription": False}
         pid = pt.data["id"]
-        recs = (
+        # Match in Postgres (trigram-indexed ILIKE) rather than scanning OCR text here
+        recs = await _exec(
             sb.table("records")
-            .select("extracted_text")
+            .select("id")
             .eq("patient_id", pid)
             .eq("record_type", "prescription")
-            .execute()
-        )
-        has_rx = any(
-            medicine_name.lower() in (r.get("extracted_text") or "").lower()
-            for r in (recs.data or [])
+            .ilike("extracted_text", f"%{medicine_name}%")
+            .limit(1)
         )
+        has_rx = bool(recs.data)
+        await _cache_set_json(cache_key, has_rx, _RX_CACHE_TTL_S, f"rx-keys:{patient_id}")
         return {"has_prescription": has_rx}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -665,8 +854,6 @@ async def verify_rx_upload(
       4. If valid, save as a prescription record in the records table
       5. Return {valid, message, extracted_text}
     """
-    import base64
-
     try:
         contents = await file.read()
         if not contents:
@@ -674,8 +861,6 @@ async def verify_rx_upload(
 
         # Determine MIME type
         mime = file.content_type or "image/jpeg"
-        # Convert to base64 for Gemini inline data
-        b64 = base64.b64encode(contents).decode("utf-8")
 
         # Ask Gemini to extract all text from the prescription document
         extraction_prompt = (
@@ -683,10 +868,10 @@ async def verify_rx_upload(
             "exactly as written. Include medicine names, dosages, instructions, patient name, "
             "doctor name, and date. Output only the extracted text, nothing else."
         )
-        model = genai.GenerativeModel("gemini-2.5-flash")
-        response = model.generate_content([
+        response = gemini_model.generate_content([
             extraction_prompt,
-            {"mime_type": mime, "data": b64},
+            # Raw bytes: the SDK handles the inline encoding itself
+            {"mime_type": mime, "data": contents},
         ])
         extracted_text = response.text.strip() if response.text else ""
 
@@ -705,10 +890,10 @@ async def verify_rx_upload(
         # Valid prescription — save to records table for future reference
         try:
             sb = _get_sb()
-            pt = sb.table("patients").select("id").eq("user_id", patient_id).single().execute()
+            pt = await _exec(sb.table("patients").select("id").eq("user_id", patient_id).single())
             if pt.data:
                 pid = pt.data["id"]
-                sb.table("records").insert({
+                await _exec(sb.table("records").insert({
                     "patient_id": pid,
                     "uploaded_by": patient_id,   # auth uid
                     "record_type": "prescription",
@@ -717,7 +902,8 @@ async def verify_rx_upload(
                     "file_name": file.filename or "prescription.jpg",
                     "file_size": len(contents),
                     "notes": f"Auto-uploaded during medicine purchase for {medicine_name}",
-                }).execute()
+                }))
+                await _cache_delete_index(f"rx-keys:{patient_id}")
         except Exception as save_err:
             print(f"⚠️ Could not save prescription record: {save_err}")
             # Don't fail the verification if saving fails
@@ -749,15 +935,22 @@ async def consume_dose(request: ConsumeDoseRequest):
     try:
         sb = _get_sb()
 
-        # Verify ownership: trace order_item → order → patients.user_id
-        item_res = (
+        # Ownership check, qty > 0 guard and decrement in one atomic UPDATE
+        res = await _exec(sb.rpc("consume_dose", {
+            "p_patient_auth_uid": request.patient_id,
+            "p_item_id": request.order_item_id,
+        }))
+        if res.data is not None:
+            return {"success": True, "remaining": res.data}
+
+        # Nothing updated: look the item up only to report why
+        item_res = await _exec(
             sb.table("order_items")
             .select("id, qty, orders(patient_id, patients(user_id))")
             .eq("id", request.order_item_id)
             .maybe_single()
-            .execute()
         )
-        if not item_res.data:
+        if not item_res or not item_res.data:
             raise HTTPException(status_code=404, detail="Order item not found")
 
         item = item_res.data
@@ -767,14 +960,7 @@ async def consume_dose(request: ConsumeDoseRequest):
         if owner_uid != request.patient_id:
             raise HTTPException(status_code=403, detail="Not your medicine")
 
-        current_qty = item.get("qty", 0)
-        if current_qty <= 0:
-            return {"success": False, "error": "No remaining units to consume"}
-
-        new_qty = current_qty - 1
-        sb.table("order_items").update({"qty": new_qty}).eq("id", request.order_item_id).execute()
-
-        return {"success": True, "remaining": new_qty}
+        return {"success": False, "error": "No remaining units to consume"}
     except HTTPException:
         raise
     except Exception as e:
@@ -793,32 +979,25 @@ async def due_doses(patient_id: str):
         IST = timezone(timedelta(hours=5, minutes=30))
         now_ist = datetime.now(IST)
 
-        sb = _get_sb()
-        pt = sb.table("patients").select("id").eq("user_id", patient_id).single().execute()
-        if not pt.data:
-            return {"success": True, "items": [], "now_ist_hour": now_ist.hour}
-        pid = pt.data["id"]
-
-        orders_res = (
-            sb.table("orders")
-            .select("id")
-            .eq("patient_id", pid)
-            .in_("status", ["fulfilled", "approved"])
-            .execute()
-        )
-        order_ids = [o["id"] for o in (orders_res.data or [])]
-        if not order_ids:
-            return {"success": True, "items": [], "now_ist_hour": now_ist.hour}
+        if _pg_pool is not None:
+            items = await _pg_pool.fetchval(_DUE_DOSES_SQL, patient_id)
+            return {"success": True, "items": items, "now_ist_hour": now_ist.hour}
 
-        items_res = (
+        sb = _get_sb()
+        # Inner-join embeds filter items by order status and owning patient in one
+        # round trip instead of patient → orders → order_items lookups
+        items_res = await _exec(
             sb.table("order_items")
-            .select("id, qty, frequency_per_day, dosage_text, medicines(name)")
-            .in_("order_id", order_ids)
+            .select(_DUE_DOSE_COLS)
+            .eq("orders.patients.user_id", patient_id)
+            .in_("orders.status", ["fulfilled", "approved"])
             .not_.is_("frequency_per_day", "null")
             .gt("qty", 0)
-            .execute()
         )
-        return {"success": True, "items": items_res.data or [], "now_ist_hour": now_ist.hour}
+        items = items_res.data or []
+        for item in items:
+            item.pop("orders", None)
+        return {"success": True, "items": items, "now_ist_hour": now_ist.hour}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -828,33 +1007,52 @@ async def due_doses(patient_id: str):
 # we decrement qty by 1 for all scheduled (frequency_per_day >= window index)
 # active order_items across all patients.
 _DOSE_WINDOWS_IST = [8, 14, 20]   # 08:00, 14:00, 20:00 IST
-_last_decremented_window: set = set()   # tracks "YYYY-MM-DD:HH" already processed
+# IST date → window hours already processed; shared with the scheduler thread
+_last_decremented: Dict[date, set] = {}
+_last_decremented_lock = threading.Lock()
+
+def _next_dose_window(now):
+    """Return (datetime, hour) of the first dose window strictly after now, rolling over to tomorrow."""
+    for hour in _DOSE_WINDOWS_IST:
+        run_at = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+        if run_at > now:
+            return run_at, hour
+    hour = _DOSE_WINDOWS_IST[0]
+    return (now + timedelta(days=1)).replace(hour=hour, minute=0, second=0, microsecond=0), hour
+
 
 def _run_scheduled_decrement():
-    """Background thread: checks every minute if a dose window has arrived."""
-    import threading
+    """Background thread: sleeps until each dose window, then decrements."""
     from datetime import datetime, timezone, timedelta
 
     IST = timezone(timedelta(hours=5, minutes=30))
 
+    def _run_window(day, hour):
+        with _last_decremented_lock:
+            if hour in _last_decremented.get(day, ()):
+                return
+            _last_decremented.setdefault(day, set()).add(hour)
+            # Forget earlier days
+            for d in list(_last_decremented):
+                if d < day:
+                    del _last_decremented[d]
+        _do_auto_decrement(hour)
+
     def _decrement_loop():
-        global _last_decremented_window
+        # Booted during a window hour: run it now rather than waiting for the next one
+        now = datetime.now(IST)
+        if now.hour in _DOSE_WINDOWS_IST:
+            _run_window(now.date(), now.hour)
+
         while True:
             try:
                 now = datetime.now(IST)
-                window_key = f"{now.date()}:{now.hour}"
-
-                if now.hour in _DOSE_WINDOWS_IST and window_key not in _last_decremented_window:
-                    _last_decremented_window.add(window_key)
-                    _do_auto_decrement(now.hour)
-
-                # Prune old keys (keep only today's)
-                today = str(now.date())
-                _last_decremented_window = {k for k in _last_decremented_window if k.startswith(today)}
-
+                run_at, hour = _next_dose_window(now)
+                time.sleep((run_at - now).total_seconds())
+                _run_window(run_at.date(), hour)
             except Exception as exc:
                 print(f"⚠️ Auto-decrement scheduler error: {exc}")
-            time.sleep(60)   # check every minute
+                time.sleep(60)
 
     t = threading.Thread(target=_decrement_loop, daemon=True, name="dose-scheduler")
     t.start()
@@ -868,32 +1066,15 @@ def _do_auto_decrement(ist_hour: int):
     that map to or before this hour).
     """
     try:
-        from datetime import datetime, timezone, timedelta
         sb = _get_sb()
 
         # Window index: 08→1, 14→2, 20→3
         window_index = _DOSE_WINDOWS_IST.index(ist_hour) + 1
 
-        # Fetch all fulfilled/approved order items with frequency_per_day set and qty > 0
-        orders_res = sb.table("orders").select("id").in_("status", ["fulfilled", "approved"]).execute()
-        if not orders_res.data:
-            return
-
-        order_ids = [o["id"] for o in orders_res.data]
-        items_res = (
-            sb.table("order_items")
-            .select("id, qty, frequency_per_day, medicines(name)")
-            .in_("order_id", order_ids)
-            .gte("frequency_per_day", window_index)   # e.g. at 14:00, only items with freq>=2
-            .gt("qty", 0)
-            .execute()
-        )
-        items = items_res.data or []
-        decremented = 0
-        for item in items:
-            new_qty = max(0, item["qty"] - 1)
-            sb.table("order_items").update({"qty": new_qty}).eq("id", item["id"]).execute()
-            decremented += 1
+        # One atomic UPDATE over all fulfilled/approved items with freq >= window_index
+        # and qty > 0 (e.g. at 14:00, only items with freq>=2)
+        res = sb.rpc("auto_decrement_doses", {"p_window_index": window_index}).execute()
+        decremented = len(res.data or [])
 
         print(f"⏰ Auto-decrement @ IST {ist_hour:02d}:00 — {decremented} items decremented")
     except Exception as exc:
@@ -903,10 +1084,59 @@ def _do_auto_decrement(ist_hour: int):
 # ── App lifespan (start scheduler on boot) ───────────────────────────────────
 from contextlib import asynccontextmanager
 
+def _warm_up():
+    """
+    Build the lazily-created clients and agents and open the Supabase/Redis
+    connections, so the first real request doesn't pay for it. Makes no
+    Gemini or ElevenLabs calls.
+    """
+    try:
+        from agents.orchestrator_agent import OrchestratorAgent as _OrchestratorAgent
+        from agents.pharmacist_orchestrator import PharmacistOrchestratorAgent as _PharmOrchestratorAgent
+        if not hasattr(pharmacy_chat, "_orchestrator"):
+            pharmacy_chat._orchestrator = _OrchestratorAgent()
+        if not hasattr(pharmacist_ai_query, "_orchestrator"):
+            pharmacist_ai_query._orchestrator = _PharmOrchestratorAgent()
+
+        _get_sb().table("medicines").select("id").limit(1).execute()
+        r = _get_redis()
+        if r is not None:
+            r.ping()
+        print("🔥 Warm-up complete")
+    except Exception as e:
+        print(f"⚠️ Warm-up failed (will initialise on first request): {e}")
+
 @asynccontextmanager
 async def lifespan(app_instance):
+    # This replaces Starlette's default lifespan, so @app.on_event handlers never
+    # run: all startup/shutdown work lives here.
+    global _pg_pool
+    print("🚀 FastAPI Healthcare AI Server Started")
+    print("📍 Server running on: http://localhost:8000")
+    print("📖 API Docs available at: http://localhost:8000/docs")
+    
+    if not os.getenv("ELEVENLABS_API_KEY"):
+        print("⚠️ WARNING: ELEVENLABS_API_KEY is missing from .env. Voice synthesis will fail.")
+    else:
+        print("✅ ElevenLabs API Key detected.")
+
+    _pg_pool = await _create_pg_pool()
     _run_scheduled_decrement()
+    # Runs in the background; startup doesn't wait for it
+    app_instance.state.warm_up_task = asyncio.create_task(asyncio.to_thread(_warm_up))
+    app_instance.state.email_task = asyncio.create_task(email_polling_task())
     yield
+    print("👋 Server shutting down...")
+    app_instance.state.email_task.cancel()
+    try:
+        await app_instance.state.email_task
+    except asyncio.CancelledError:
+        pass
+    await voice_service.aclose()
+    if _pg_pool is not None:
+        await _pg_pool.close()
+    if _get_parse_pool.cache_info().currsize:
+        _get_parse_pool().shutdown(wait=False, cancel_futures=True)
 
 
 # Patch the lifespan onto the existing app
@@ -945,8 +1175,7 @@ async def pharmacy_chat(request: PharmacyChatRequest):
             try:
                 audio_bytes = await voice_service.synthesize_empathic(ai_text, request.language)
                 if audio_bytes:
-                    import base64
-                    audio_data_b64 = base64.b64encode(audio_bytes).decode("utf-8")
+                    audio_data_b64 = await _encode_audio(audio_bytes)
             except Exception as ve:
                 print(f"⚠️ Pharmacy Voice synthesis failed: {ve}")
 
@@ -973,6 +1202,17 @@ async def pharmacy_chat(request: PharmacyChatRequest):
         return ChatResponse(success=False, response=fallbacks.get(lang, fallbacks["en"]), error=error_msg)
 
 
+# ---- Vitals parsing pool (regex parsing is CPU-bound; fan out across cores) ----
+# parse_medical_text costs ~0.2 ms per KB of text, against ~0.15 ms IPC per task and
+# ~100 ms to start the pool; below ~200 KB in total (~40 ms serial) the pool doesn't pay.
+_PARSE_POOL_MIN_CHARS = 200_000
+
+@functools.lru_cache(maxsize=1)
+def _get_parse_pool() -> ProcessPoolExecutor:
+    # forkserver, not fork: forking this multi-threaded server could copy a held
+    # lock (stdout, httpx, the scheduler) into a child that would then deadlock
+    return ProcessPoolExecutor(mp_context=multiprocessing.get_context("forkserver"))
+
 @app.post("/health_trends")
 async def get_health_trends(request: HealthAnalysisRequest):
     """
@@ -984,12 +1224,18 @@ async def get_health_trends(request: HealthAnalysisRequest):
         
         timeline = []
         
-        for record in history:
-            # Parse vitals from this specific document
-            # Use same cleaning as ml_engine
-            clean_text = record['text'].lower().replace(':', ' ').replace('-', ' ').replace('\n', ' ').replace('*', ' ').replace('#', ' ')
-            vitals = parse_medical_text(clean_text) # Re-use the robust function
-            
+        # Parse vitals from each document (parse_medical_text does its own cleaning)
+        texts = [record['text'] for record in history]
+        if sum(map(len, texts)) >= _PARSE_POOL_MIN_CHARS:
+            loop = asyncio.get_running_loop()
+            pool = _get_parse_pool()
+            vitals_list = await asyncio.gather(
+                *(loop.run_in_executor(pool, parse_medical_text, text) for text in texts)
+            )
+        else:
+            vitals_list = [parse_medical_text(text) for text in texts]
+        
+        for record, vitals in zip(history, vitals_list):
             # Only include if at least one key metric is found
             if any(v is not None for v in [vitals['systolic'], vitals['sugar'], vitals['heart_rate'], vitals['weight']]):
                 timeline.append({
@@ -1019,67 +1265,88 @@ async def root():
     }
 
 
-# In-memory storage for chat history
-# Format: { user_id: [ {"role": "user", "parts": ["msg"]}, {"role": "model", "parts": ["response"]} ] }
+# Chat history: Redis list "chat:{user_id}" (newest first), else chat_sessions
+# Message format: {"role": "user" | "model", "parts": ["text"]}
+_CHAT_HISTORY_MAX_MSGS = 20       # stored per user
+_CHAT_HISTORY_PROMPT_MSGS = 10    # sent to the model
+_CHAT_HISTORY_TTL_S = 86400
+_CHAT_SESSIONS_MAX_USERS = 1000   # in-memory fallback bound
 
-@app.post("/chat")
-@observe()
-async def chat(request: ChatRequest):
-    """
-    Main chat endpoint with RAG support, context window, and optional voice output
-    """
-    try:
-        print(f"📩 Chat Query: {request.message}")
-        print(f"🎤 Use Voice: {request.use_voice}")
-        print(f"🔐 Use Records: {request.use_records}")
-        
-        user_id = request.user_id or "anonymous"
-        
-        # Initialize history for user if not exists
-        if user_id not in chat_sessions:
-            chat_sessions[user_id] = []
-        
-        # Get recent history (limit to last 10 messages for context window management)
-        recent_history = chat_sessions[user_id][-10:]
-        
-        # Format history for prompt
-        history_text = ""
-        for msg in recent_history:
-            role = "User" if msg["role"] == "user" else "Assistant"
-            content = msg["parts"][0]
-            history_text += f"{role}: {content}\n"
-
-        context_text = ""
-        
-        # Search medical records if enabled
-        if request.user_id and request.use_records:
-            context_text = await rag_service.search_records(
-                user_id=request.user_id,
-                query=request.message
-            )
-            if context_text:
-                print(f"✅ Found relevant medical records")
-        
-        # Detect if message is a greeting or casual conversation
-        greeting_keywords = [
-            'hi', 'hello', 'hey', 'good morning', 'good afternoon', 'good evening',
-            'how are you', 'whats up', "what's up", 'greetings', 'namaste', 
-            'thanks', 'thank you', 'bye', 'goodbye', 'see you', 'ok', 'okay',
-            'cool', 'nice', 'great', 'awesome', 'perfect'
-        ]
-        is_greeting = any(request.message.lower().strip() in keyword or keyword in request.message.lower() 
-                         for keyword in greeting_keywords)
-        
-        # Detect if user wants detailed explanation
-        detail_keywords = ['explain', 'detail', 'elaborate', 'tell me more', 'in depth', 'long', 'why', 'how does']
-        wants_detail = any(keyword in request.message.lower() for keyword in detail_keywords)
-        print(f"👋 Is greeting: {is_greeting}")
-        print(f"📝 Detail mode: {wants_detail}")
-        
-# Build simple, adaptive system prompt
-        if is_greeting and not history_text: # Only use greeting prompt if it's the start
-            # Simple conversational prompt for greetings
-            system_prompt = f"""
+async def _load_chat_history(user_id: str) -> List[dict]:
+    """Return the user's most recent chat messages, oldest first."""
+    r = _get_redis()
+    if r is not None:
+        try:
+            raw = await asyncio.to_thread(r.lrange, f"chat:{user_id}", 0, _CHAT_HISTORY_PROMPT_MSGS - 1)
+            return [orjson.loads(m) for m in reversed(raw)]
+        except redis.RedisError as e:
+            print(f"⚠️ Redis chat history read failed: {e}")
+    return list(chat_sessions.get(user_id, ()))[-_CHAT_HISTORY_PROMPT_MSGS:]
+
+async def _append_chat_turn(user_id: str, user_text: str, model_text: str) -> None:
+    """Record one user/model exchange in the user's bounded chat history."""
+    msgs = [{"role": "user", "parts": [user_text]}, {"role": "model", "parts": [model_text]}]
+    r = _get_redis()
+    if r is not None:
+        try:
+            key = f"chat:{user_id}"
+            pipe = r.pipeline()
+            pipe.lpush(key, *(orjson.dumps(m) for m in msgs))
+            pipe.ltrim(key, 0, _CHAT_HISTORY_MAX_MSGS - 1)
+            pipe.expire(key, _CHAT_HISTORY_TTL_S)
+            await asyncio.to_thread(pipe.execute)
+            return
+        except redis.RedisError as e:
+            print(f"⚠️ Redis chat history write failed: {e}")
+    session = chat_sessions.pop(user_id, None) or deque(maxlen=_CHAT_HISTORY_MAX_MSGS)
+    session.extend(msgs)
+    chat_sessions[user_id] = session
+    while len(chat_sessions) > _CHAT_SESSIONS_MAX_USERS:
+        chat_sessions.popitem(last=False)
+
+async def _format_chat_history(user_id: str) -> str:
+    """Render the last 10 messages of a user's chat session as prompt text."""
+    recent_history = await _load_chat_history(user_id)
+
+    history_text = ""
+    for msg in recent_history:
+        role = "User" if msg["role"] == "user" else "Assistant"
+        content = msg["parts"][0]
+        history_text += f"{role}: {content}\n"
+    return history_text
+
+
+# Detect greetings / casual conversation and requests for detailed explanations
+_GREETING_KEYWORDS = (
+    'hi', 'hello', 'hey', 'good morning', 'good afternoon', 'good evening',
+    'how are you', 'whats up', "what's up", 'greetings', 'namaste', 
+    'thanks', 'thank you', 'bye', 'goodbye', 'see you', 'ok', 'okay',
+    'cool', 'nice', 'great', 'awesome', 'perfect'
+)
+# Every substring of every keyword, so "is the message part of a keyword" is one set lookup
+_GREETING_FRAGMENTS = frozenset(
+    kw[i:j] for kw in _GREETING_KEYWORDS for i in range(len(kw) + 1) for j in range(i, len(kw) + 1)
+)
+_GREETING_RE = re.compile("|".join(map(re.escape, sorted(_GREETING_KEYWORDS, key=len, reverse=True))))
+_DETAIL_RE = re.compile("|".join(map(re.escape, (
+    'explain', 'detail', 'elaborate', 'tell me more', 'in depth', 'long', 'why', 'how does'
+))))
+
+def _build_chat_prompt(message: str, language: str, history_text: str, context_text: str) -> str:
+    """Build the full /chat prompt: adaptive system prompt + patient message."""
+    msg = message.lower().strip()
+    # Greeting: the message is (part of) a greeting keyword, or contains one
+    is_greeting = msg in _GREETING_FRAGMENTS or bool(_GREETING_RE.search(msg))
+    
+    # Detect if user wants detailed explanation
+    wants_detail = bool(_DETAIL_RE.search(msg))
+    print(f"👋 Is greeting: {is_greeting}")
+    print(f"📝 Detail mode: {wants_detail}")
+    
+    # Build simple, adaptive system prompt
+    if is_greeting and not history_text: # Only use greeting prompt if it's the start
+        # Simple conversational prompt for greetings
+        system_prompt = f"""
 You are a friendly Healthcare AI assistant. The user sent a greeting or casual message.
 
 Respond warmly and naturally in a conversational way. Keep it SHORT (1-2 sentences max).
@@ -1093,12 +1360,12 @@ LANGUAGE REQUIREMENT:
 - **Script Policy**: 
   - If Hindi/Marathi -> Use Devanagari script.
   - If English -> Use English.
-- **UI Guide**: The user's current UI language is '{request.language}'.
+- **UI Guide**: The user's current UI language is '{language}'.
 - **Strict Consistency**: Never mix scripts. 100% Devanagari for Hindi/Marathi.
 """
-        else:
-            # Structured medical response prompt
-            system_prompt = f"""
+    else:
+        # Structured medical response prompt
+        system_prompt = f"""
 You are a friendly, empathetic Healthcare AI. 
 
 PREVIOUS CONVERSATION HISTORY:
@@ -1109,7 +1376,7 @@ CONTEXT FROM RECORDS: {context_text}
 CORE INSTRUCTIONS:
 1. **LANGUAGE**: Prioritize matching the user's conversational language.
    - If the user uses Hindi or Marathi (even in Roman script), you MUST respond in that language using Devanagari script.
-   - UI language hint: '{request.language}'.
+   - UI language hint: '{language}'.
    - Even if the user uses a few English words, DO NOT answer in English if the core conversation is Hindi/Marathi. Translate technical medical terms into the target script.
    - CRITICAL: Never mix scripts. 100% Devanagari for Hindi/Marathi.
    
@@ -1131,26 +1398,143 @@ Language Guidelines:
 - Use simple words (e.g., "tummy" for "abdomen" is okay if context fits, but standard simple English/Hinglish is best).
 """
 
+    return system_prompt + "\n\nPatient Message: " + message
+
+
+_CHAT_GENERATION_CONFIG = genai.GenerationConfig(
+    temperature=0.7,
+    max_output_tokens=2048,
+)
+
+# ── General-answer cache ─────────────────────────────────────────────────────
+# Without records or prior history the /chat prompt is a pure function of
+# (message, language), so answers to common questions are reused.
+# Bump _CHAT_PROMPT_VERSION whenever _build_chat_prompt changes.
+_CHAT_PROMPT_VERSION = 1
+_GENERAL_ANSWER_CACHE_SIZE = 10_000
+_general_answer_cache: "OrderedDict[str, str]" = OrderedDict()
+
+
+def _general_answer_key(message: str, language: str) -> str:
+    raw = f"{_CHAT_PROMPT_VERSION}|{language}|{message.strip().lower()}"
+    return hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+
+def _get_general_answer(key: str) -> Optional[str]:
+    answer = _general_answer_cache.get(key)
+    if answer is not None:
+        _general_answer_cache.move_to_end(key)
+    return answer
+
+
+def _put_general_answer(key: str, answer: str) -> None:
+    _general_answer_cache[key] = answer
+    _general_answer_cache.move_to_end(key)
+    if len(_general_answer_cache) > _GENERAL_ANSWER_CACHE_SIZE:
+        _general_answer_cache.popitem(last=False)
+
+
+# Localized messages shown to the user when the assistant can't answer
+_CHAT_ERROR_FALLBACKS = {
+    "hi": "क्षमा करें, मैं अभी उस अनुरोध को संसाधित नहीं कर सका। कृपया कुछ ही पलों में पुन: प्रयास करें। 💙",
+    "mr": "क्षमस्व, मी आत्ता त्या विनंतीवर प्रक्रिया करू शकलो नाही. कृपया थोड्या वेळात पुन्हा प्रयत्न करा. 💙",
+    "en": "I'm sorry, I couldn't process that request right now. Please try again in a moment. 💙",
+}
+_CHAT_QUOTA_FALLBACKS = {
+    "hi": "मुझे अभी बहुत सारे अनुरोध मिल रहे हैं। कृपया एक पल प्रतीक्षा करें और पुन: प्रयास करें।",
+    "mr": "मला सध्या खूप विनंत्या येत आहेत. कृपया क्षणभर थांबा आणि पुन्हा प्रयत्न करा.",
+    "en": "I'm currently receiving too many requests. Please wait a moment and try again.",
+}
+
+def _chat_fallback(language: str, error_msg: str = "") -> str:
+    """User-facing fallback for a failed chat turn; raw SDK errors stay in the logs."""
+    if "429" in error_msg or "quota" in error_msg.lower() or "RESOURCE_EXHAUSTED" in error_msg:
+        return _CHAT_QUOTA_FALLBACKS.get(language, _CHAT_QUOTA_FALLBACKS["en"])
+    return _CHAT_ERROR_FALLBACKS.get(language, _CHAT_ERROR_FALLBACKS["en"])
+
+
+# ── Gemini circuit breaker ───────────────────────────────────────────────────
+# After repeated consecutive failures (quota, outage) stop calling Gemini for a
+# cool-down period and answer with the fallback message straight away.
+_GEMINI_BREAKER_THRESHOLD = 5
+_GEMINI_BREAKER_COOLDOWN_S = 30
+_gemini_failures = 0
+_gemini_open_until = 0.0
+
+
+def _gemini_breaker_open() -> bool:
+    return time.monotonic() < _gemini_open_until
+
+
+def _record_gemini_result(ok: bool) -> None:
+    global _gemini_failures, _gemini_open_until
+    if ok:
+        _gemini_failures = 0
+        return
+    _gemini_failures += 1
+    if _gemini_failures >= _GEMINI_BREAKER_THRESHOLD:
+        _gemini_open_until = time.monotonic() + _GEMINI_BREAKER_COOLDOWN_S
+        _gemini_failures = 0
+        print(f"⚡ Gemini circuit open for {_GEMINI_BREAKER_COOLDOWN_S}s after repeated failures")
+
+@app.post("/chat")
+@observe()
+async def chat(request: ChatRequest):
+    """
+    Main chat endpoint with RAG support, context window, and optional voice output
+    """
+    try:
+        print(f"📩 Chat Query: {request.message}")
+        print(f"🎤 Use Voice: {request.use_voice}")
+        print(f"🔐 Use Records: {request.use_records}")
         
-        # Using gemini-2.5-flash as standardized
-        try:
-            print("🤖 Health Assistant (Using gemini-2.5-flash)")
-            response = gemini_model.generate_content(
-                system_prompt + "\n\nPatient Message: " + request.message,
-                generation_config=genai.GenerationConfig(
-                    temperature=0.7,
-                    max_output_tokens=2048,
-                )
+        user_id = request.user_id or "anonymous"
+        history_text = await _format_chat_history(user_id)
+
+        context_text = ""
+        
+        # Search medical records if enabled
+        if request.user_id and request.use_records:
+            context_text = await rag_service.search_records(
+                user_id=request.user_id,
+                query=request.message
             )
-        except Exception as e:
-            print(f"❌ Gemini Error: {e}")
-            raise e
+            if context_text:
+                print(f"✅ Found relevant medical records")
         
-        # Process response
-        if hasattr(response, 'text') and response.text:
-            ai_text = response.text
-        elif hasattr(response, 'candidates') and len(response.candidates) > 0:
-            ai_text = response.candidates[0].content.parts[0].text
+        prompt = _build_chat_prompt(request.message, request.language, history_text, context_text)
+
+        cache_key = None
+        if not (request.user_id and request.use_records) and not history_text:
+            cache_key = _general_answer_key(request.message, request.language)
+
+        ai_text = _get_general_answer(cache_key) if cache_key else None
+        if ai_text:
+            print("⚡ General answer cache hit")
+        elif _gemini_breaker_open():
+            print("⚡ Gemini circuit open, skipping call")
+        else:
+            # Using gemini-2.5-flash as standardized
+            try:
+                print("🤖 Health Assistant (Using gemini-2.5-flash)")
+                response = gemini_model.generate_content(
+                    prompt,
+                    generation_config=_CHAT_GENERATION_CONFIG,
+                )
+            except Exception as e:
+                print(f"❌ Gemini Error: {e}")
+                _record_gemini_result(False)
+                raise e
+            _record_gemini_result(True)
+            
+            # Process response
+            if hasattr(response, 'text') and response.text:
+                ai_text = response.text
+            elif hasattr(response, 'candidates') and len(response.candidates) > 0:
+                ai_text = response.candidates[0].content.parts[0].text
+            
+            if ai_text and cache_key:
+                _put_general_answer(cache_key, ai_text)
         
         if ai_text:
             print(f"✅ Got response: {len(ai_text)} characters")
@@ -1158,20 +1542,10 @@ Language Guidelines:
         # If no response after retries, use fallback
         if not ai_text:
             print("📝 Using fallback response")
-            # Include the error for debugging
-            debug_info = f" (Error: {last_error_msg})" if 'last_error_msg' in locals() else ""
-            
-            error_fallbacks = {
-                "hi": f"क्षमा करें, मैं अभी उस अनुरोध को संसाधित नहीं कर सका।{debug_info} कृपया कुछ ही पलों में पुन: प्रयास करें। 💙",
-                "mr": f"क्षमस्व, मी आत्ता त्या विनंतीवर प्रक्रिया करू शकलो नाही.{debug_info} कृपया थोड्या वेळात पुन्हा प्रयत्न करा. 💙",
-                "en": f"I'm sorry, I couldn't process that request right now.{debug_info} Please try again in a moment. 💙"
-            }
-            ai_text = error_fallbacks.get(request.language, error_fallbacks["en"])
+            ai_text = _chat_fallback(request.language)
         else:
             # Store conversation in history if response was successful
-            if user_id in chat_sessions:
-                chat_sessions[user_id].append({"role": "user", "parts": [request.message]})
-                chat_sessions[user_id].append({"role": "model", "parts": [ai_text]})
+            await _append_chat_turn(user_id, request.message, ai_text)
         
         # Generate voice if requested
         audio_data_b64 = None
@@ -1182,8 +1556,7 @@ Language Guidelines:
                     language=request.language
                 )
                 if audio_bytes:
-                    import base64
-                    audio_data_b64 = base64.b64encode(audio_bytes).decode('utf-8')
+                    audio_data_b64 = await _encode_audio(audio_bytes)
             except Exception as e:
                 print(f"⚠️ Voice synthesis failed: {e}")
                 # Continue without voice
@@ -1206,6 +1579,85 @@ Language Guidelines:
             error=str(e)
         )
 
+def _sse(payload: dict) -> bytes:
+    """Encode one server-sent event."""
+    return b"data: " + orjson.dumps(payload) + b"\n\n"
+
+
+@app.post("/chat/stream")
+@observe()
+async def chat_stream(request: ChatRequest):
+    """
+    Streaming variant of /chat. Emits Server-Sent Events as Gemini generates:
+      data: {"delta": "..."}   — next piece of the answer
+      data: {"done": true}     — generation finished (history saved)
+      data: {"error": "..."}   — generation failed (localized message for the user)
+    Voice is not included; the client requests /synthesize_voice once done.
+    """
+    print(f"📩 Chat Query (stream): {request.message}")
+
+    user_id = request.user_id or "anonymous"
+    history_text = await _format_chat_history(user_id)
+
+    context_text = ""
+    if request.user_id and request.use_records:
+        context_text = await rag_service.search_records(
+            user_id=request.user_id,
+            query=request.message
+        )
+
+    prompt = _build_chat_prompt(request.message, request.language, history_text, context_text)
+
+    cache_key = None
+    if not (request.user_id and request.use_records) and not history_text:
+        cache_key = _general_answer_key(request.message, request.language)
+
+    async def event_stream():
+        cached = _get_general_answer(cache_key) if cache_key else None
+        if cached:
+            await _append_chat_turn(user_id, request.message, cached)
+            yield _sse({'delta': cached})
+            yield _sse({'done': True})
+            return
+        if _gemini_breaker_open():
+            yield _sse({'error': _chat_fallback(request.language)})
+            return
+
+        parts = []
+        try:
+            response = await gemini_model.generate_content_async(
+                prompt,
+                generation_config=_CHAT_GENERATION_CONFIG,
+                stream=True,
+            )
+            async for chunk in response:
+                try:
+                    text = chunk.text
+                except ValueError:
+                    continue  # chunk without text parts (e.g. safety metadata)
+                if text:
+                    parts.append(text)
+                    yield _sse({'delta': text})
+        except Exception as e:
+            print(f"❌ Gemini Stream Error: {e}")
+            _record_gemini_result(False)
+            yield _sse({'error': _chat_fallback(request.language, str(e))})
+            return
+        _record_gemini_result(True)
+
+        ai_text = "".join(parts)
+        if ai_text:
+            if cache_key:
+                _put_general_answer(cache_key, ai_text)
+            await _append_chat_turn(user_id, request.message, ai_text)
+        yield _sse({'done': True})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
 @app.post("/synthesize_voice")
 async def synthesize_voice(request: dict):
     """
@@ -1218,14 +1670,26 @@ async def synthesize_voice(request: dict):
         if not text:
             raise HTTPException(status_code=400, detail="Text is required")
         
-        audio_data = await voice_service.synthesize_empathic(text, language)
-        
-        if not audio_data:
+        # Stream audio as ElevenLabs produces it. Wait for the first chunk here
+        # so synthesis errors still surface as a 500 instead of a broken stream.
+        audio_stream = voice_service.synthesize_empathic_stream(text, language)
+        try:
+            first_chunk = await audio_stream.__anext__()
+        except StopAsyncIteration:
             raise HTTPException(status_code=500, detail="Voice synthesis failed")
         
-        # Return audio as streaming response
+        async def audio_body():
+            # Close the upstream generator even if the client disconnects mid-stream,
+            # so its httpx stream is released now rather than at garbage collection
+            try:
+                yield first_chunk
+                async for chunk in audio_stream:
+                    yield chunk
+            finally:
+                await audio_stream.aclose()
+        
         return StreamingResponse(
-            io.BytesIO(audio_data),
+            audio_body(),
             media_type="audio/mpeg",
             headers={
                 "Content-Disposition": "attachment; filename=response.mp3"
@@ -1250,6 +1714,12 @@ async def process_document(request: DocumentProcessRequest):
             patient_id=request.patient_id
         )
         
+        # Newly extracted text may contain a prescription: drop cached /check-rx answers
+        if _get_redis() is not None:
+            pt = await _exec(_get_sb().table("patients").select("user_id").eq("id", request.patient_id).maybe_single())
+            if pt and pt.data:
+                await _cache_delete_index(f"rx-keys:{pt.data['user_id']}")
+        
         return {
             "success": True,
             "chunks": result["chunks"],
@@ -1265,6 +1735,58 @@ async def process_document(request: DocumentProcessRequest):
             "error": str(e)
         }
 
+_DIGITS_RE = re.compile(r'\d+')
+_GEMINI_VITAL_KEYS = ('bp', 'sugar', 'heart_rate', 'weight', 'age', 'blood_group')
+_NUMERIC_VITAL_KEYS = frozenset({'sugar', 'heart_rate', 'weight', 'age'})
+
+# Patients with more records than this get only the top-K matches for the query in the prompt
+_ANALYSIS_TOP_K = 5
+_ANALYSIS_RECORDS_QUERY = "vitals blood pressure BP sugar glucose heart rate HR weight age blood group"
+
+# Parsed Gemini health analyses, keyed by (user_id, prompt + records hash)
+_analysis_cache: TTLCache = TTLCache(maxsize=512, ttl=600)
+
+# Gemini context caching for big record sets (~4k tokens and up; smaller ones are cheaper inline)
+_RECORDS_CONTEXT_MIN_CHARS = 16_000
+_RECORDS_CONTEXT_TTL_S = 600
+# Expire locally a minute before Gemini does, so we never use a deleted cache
+_records_context_models: TTLCache = TTLCache(maxsize=128, ttl=_RECORDS_CONTEXT_TTL_S - 60)
+# Called from worker threads: TTLCache isn't thread-safe, and two concurrent analyses
+# for one patient must not each create (and pay for) a CachedContent
+_records_context_lock = threading.Lock()
+_records_context_key_locks: Dict[tuple, threading.Lock] = {}
+
+def _records_context_model(user_id: str, records_text: str) -> genai.GenerativeModel:
+    """Model bound to a Gemini cached context holding this patient's records."""
+    key = (user_id, hashlib.blake2b(records_text.encode(), digest_size=16).digest())
+    # The global lock only covers cache reads/writes; each key has its own lock held
+    # across the upload, so other patients never wait on it
+    with _records_context_lock:
+        model = _records_context_models.get(key)
+        if model is not None:
+            return model
+        key_lock = _records_context_key_locks.setdefault(key, threading.Lock())
+
+    try:
+        with key_lock:
+            # A concurrent caller for the same key may have created it while we waited
+            with _records_context_lock:
+                model = _records_context_models.get(key)
+            if model is None:
+                cache = caching.CachedContent.create(
+                    model="models/gemini-2.5-flash",
+                    display_name=f"records-{user_id}",
+                    contents=[f"Patient Records: {records_text}"],
+                    ttl=timedelta(seconds=_RECORDS_CONTEXT_TTL_S),
+                )
+                model = genai.GenerativeModel.from_cached_content(cached_content=cache)
+                with _records_context_lock:
+                    _records_context_models[key] = model
+            return model
+    finally:
+        with _records_context_lock:
+            _records_context_key_locks.pop(key, None)
+
 @app.post("/analyze_health")
 async def analyze_health(request: HealthAnalysisRequest):
     """
@@ -1281,7 +1803,7 @@ async def analyze_health(request: HealthAnalysisRequest):
             pass
         
         # Run ML analysis
-        analysis_result = analyze_risk(text_records)
+        analysis_result = await asyncio.to_thread(analyze_risk, text_records)
         print(f"🔬 ML/Regex Result: {analysis_result}")
         
         # Generate Comprehensive Advice using Gemini
@@ -1290,11 +1812,28 @@ async def analyze_health(request: HealthAnalysisRequest):
         if not vitals_str:
             vitals_str = "No specific vitals extracted from records."
 
+        # Regex ran over every record above; Gemini only needs the most vitals-relevant chunks
+        prompt_records = text_records
+        if len(text_records) > _ANALYSIS_TOP_K:
+            prompt_records = await rag_service.get_relevant_records(
+                request.user_id, _ANALYSIS_RECORDS_QUERY, k=_ANALYSIS_TOP_K
+            ) or text_records
+
+        # Large record sets go to Gemini once as cached context; the prompt then refers to them
+        records_text = str(prompt_records)
+        records_model = None
+        if len(records_text) >= _RECORDS_CONTEXT_MIN_CHARS:
+            try:
+                records_model = await asyncio.to_thread(_records_context_model, request.user_id, records_text)
+            except Exception as ce:
+                print(f"⚠️ Gemini context cache unavailable, sending records inline: {ce}")
+        records_ref = "(see the patient records in the cached context)" if records_model else records_text
+
         prompt = f"""
         You are a smart medical AI assistant.
         Patient Vitals (pre-extracted): {vitals_str}
         Risk Assessment: {analysis_result['risk_level']}
-        Patient Records: {text_records}
+        Patient Records: {records_ref}
         
         Task:
         1. Extract ANY missing vitals from the Patient Records text if they are invalid/missing in the "Patient Vitals" above.
@@ -1327,41 +1866,41 @@ async def analyze_health(request: HealthAnalysisRequest):
         """
                 
         try:
-            print("🤖 Sending prompt to Gemini...")
-            gemini_response = gemini_model.generate_content(prompt)
-            print(f"📝 Raw Gemini Response: {gemini_response.text[:500]}...") # Print first 500 chars
-            
-            # Simple cleanup to ensure valid JSON
-            text_resp = gemini_response.text.replace("```json", "").replace("```", "").strip()
-            import json
-            ai_insights = json.loads(text_resp)
+            # Same records → same prompt: reuse the parsed answer for a while
+            cache_key = (request.user_id, hashlib.blake2b((prompt + records_text).encode(), digest_size=16).digest())
+            ai_insights = _analysis_cache.get(cache_key)
+            if ai_insights is not None:
+                print("⚡ Health analysis cache hit")
+            else:
+                print("🤖 Sending prompt to Gemini...")
+                # JSON mode: Gemini returns bare JSON, so no code-fence cleanup before parsing
+                gemini_response = await asyncio.to_thread(
+                    (records_model or gemini_model).generate_content,
+                    prompt,
+                    generation_config={"response_mime_type": "application/json"}
+                )
+                print(f"📝 Raw Gemini Response: {gemini_response.text[:500]}...") # Print first 500 chars
+                
+                ai_insights = orjson.loads(gemini_response.text)
+                _analysis_cache[cache_key] = ai_insights
             print(f"✅ Parsed JSON: {ai_insights.get('extracted_vitals')}")
             
             # MERGE GEMINI VITALS IF REGEX FAILED
             gemini_vitals = ai_insights.get("extracted_vitals", {})
             
-            # Helper to safely update simple fields if they are None/Empty
-            def update_if_missing(key, val):
-                if not analysis_result['vitals_detected'].get(key) and val:
-                     # Try to convert to int if it's a number string
-                    try:
-                        if key in ['sugar', 'heart_rate', 'weight', 'age']:
-                            # simple heuristic to grab first number
-                            import re
-                            nums = re.findall(r'\d+', str(val))
-                            if nums:
-                                analysis_result['vitals_detected'][key] = int(nums[0])
-                        else:
-                            analysis_result['vitals_detected'][key] = val
-                    except:
-                        pass # Keep original None if conversion fails
-
-            update_if_missing('bp', gemini_vitals.get('bp'))
-            update_if_missing('sugar', gemini_vitals.get('sugar'))
-            update_if_missing('heart_rate', gemini_vitals.get('heart_rate'))
-            update_if_missing('weight', gemini_vitals.get('weight'))
-            update_if_missing('age', gemini_vitals.get('age'))
-            update_if_missing('blood_group', gemini_vitals.get('blood_group'))
+            # Fill only fields the regex pass left None/Empty, in one loop
+            detected = analysis_result['vitals_detected']
+            for key in _GEMINI_VITAL_KEYS:
+                val = gemini_vitals.get(key)
+                if detected.get(key) or not val:
+                    continue
+                if key in _NUMERIC_VITAL_KEYS:
+                    # simple heuristic to grab first number
+                    match = _DIGITS_RE.search(str(val))
+                    if match:
+                        detected[key] = int(match.group())
+                else:
+                    detected[key] = val
 
         except Exception as e:
             print(f"⚠️ Gemini Analysis Failed: {e}")
@@ -1423,8 +1962,7 @@ async def agent_chat(request: AgentChatRequest):
             try:
                 audio_bytes = await voice_service.synthesize_empathic(result["response"], request.language)
                 if audio_bytes:
-                    import base64
-                    audio_data_b64 = base64.b64encode(audio_bytes).decode("utf-8")
+                    audio_data_b64 = await _encode_audio(audio_bytes)
             except Exception as ve:
                 print(f"⚠️ Agent voice synthesis failed: {ve}")
 
@@ -1478,8 +2016,7 @@ async def pharmacist_ai_query(req: PharmacistAIRequest):
             clean_tts = ai_text.replace('*', '').replace('#', '').strip()
             audio_bytes = await voice_service.synthesize_empathic(clean_tts, req.language)
             if audio_bytes:
-                import base64
-                audio_data = base64.b64encode(audio_bytes).decode('utf-8')
+                audio_data = await _encode_audio(audio_bytes)
 
         return ChatResponse(
             success=True,
@@ -1509,13 +2046,35 @@ async def pharmacist_ai_query(req: PharmacistAIRequest):
 
 
 # ==========================================
-# Startup/Shutdown Events & Background Jobs
+# Background Jobs (started from lifespan)
 # ==========================================
-import asyncio
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from supabase import create_client
+from supabase import acreate_client
+
+_EMAIL_POLL_FALLBACK_S = 300   # safety net scan while realtime is connected
+_EMAIL_POLL_INTERVAL_S = 15    # plain polling when realtime is unavailable
+
+async def _subscribe_email_alerts(wake: asyncio.Event):
+    """Set wake whenever an email notification is inserted. Returns the client, or None."""
+    try:
+        client = await acreate_client(
+            os.getenv("VITE_SUPABASE_URL"),
+            os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+        )
+        await client.channel("email-alerts").on_postgres_changes(
+            "INSERT",
+            schema="public",
+            table="notification_logs",
+            filter="channel=eq.email",
+            callback=lambda _payload: wake.set(),
+        ).subscribe()
+        print("📡 Subscribed to notification_logs inserts")
+        return client
+    except Exception as e:
+        print(f"⚠️ Realtime subscription failed, polling every {_EMAIL_POLL_INTERVAL_S}s: {e}")
+        return None
 
 async def email_polling_task():
     print("📧 Starting Email Polling Service for Pharmacist Alerts...")
@@ -1525,14 +2084,22 @@ async def email_polling_task():
     smtp_password = os.getenv("SMTP_APP_PASSWORD", "")
     pharmacist_email = os.getenv("PHARMACIST_EMAIL", smtp_user)
     
-    supa = create_client(
-        os.getenv("VITE_SUPABASE_URL"),
-        os.getenv("SUPABASE_SERVICE_ROLE_KEY")
-    )
+    supa = _get_sb()
+
+    def _connect_smtp():
+        server = smtplib.SMTP(smtp_server, smtp_port, timeout=10)
+        server.starttls()
+        server.login(smtp_user, smtp_password)
+        return server
 
     def _poll_and_send():
         res = supa.table("notification_logs").select("*").eq("status", "pending").eq("channel", "email").execute()
-        if res.data:
+        if not res.data:
+            return
+        # One SMTP session for the whole batch, opened on the first email
+        server = None
+        sent_ids, failed_ids = [], []
+        try:
             for notif in res.data:
                 payload = notif.get("payload", {})
                 med_name = payload.get("medicine_name", "Unknown")
@@ -1549,43 +2116,60 @@ async def email_polling_task():
                         body = f"Hello Pharmacist,\n\nOur system detected critically low inventory for {med_name}.\n\nCurrent Stock: {stock}\nReorder Threshold: {threshold}\n\nPlease restock immediately.\n\n- MyHealthChain AI Agent"
                         msg.attach(MIMEText(body, 'plain'))
                         
-                        server = smtplib.SMTP(smtp_server, smtp_port, timeout=10)
-                        server.starttls()
-                        server.login(smtp_user, smtp_password)
-                        server.send_message(msg)
-                        server.quit()
+                        if server is None:
+                            server = _connect_smtp()
+                        try:
+                            server.send_message(msg)
+                        except smtplib.SMTPServerDisconnected:
+                            server = _connect_smtp()
+                            server.send_message(msg)
                         print(f"✅ Sent email alert for {med_name} to {pharmacist_email}")
                     except Exception as e:
                         print(f"❌ Failed to send email for {notif['id']}: {e}")
+                        failed_ids.append(notif["id"])
+                        continue
                 else:
                     print(f"⚠️ SMTP credentials missing. Simulated Email Sent for {med_name} to pharmacist.")
 
-                supa.table("notification_logs").update({"status": "sent"}).eq("id", notif["id"]).execute()
-
-    while True:
-        try:
-            await asyncio.to_thread(_poll_and_send)
-        except Exception as e:
-             pass
-             
-        await asyncio.sleep(15)
+                sent_ids.append(notif["id"])
+        finally:
+            if server is not None:
+                try:
+                    server.quit()
+                except smtplib.SMTPException:
+                    pass
+
+        # One status update per outcome instead of one per row
+        if sent_ids:
+            supa.table("notification_logs").update({"status": "sent"}).in_("id", sent_ids).execute()
+        if failed_ids:
+            supa.table("notification_logs").update({"status": "failed"}).in_("id", failed_ids).execute()
+
+    # Realtime inserts wake the loop; the timeout is only a fallback scan
+    wake = asyncio.Event()
+    realtime_client = await _subscribe_email_alerts(wake)
+    interval = _EMAIL_POLL_FALLBACK_S if realtime_client else _EMAIL_POLL_INTERVAL_S
 
-@app.on_event("startup")
-async def startup_event():
-    print("🚀 FastAPI Healthcare AI Server Started")
-    print("📍 Server running on: http://localhost:8000")
-    print("📖 API Docs available at: http://localhost:8000/docs")
-    
-    if not os.getenv("ELEVENLABS_API_KEY"):
-        print("⚠️ WARNING: ELEVENLABS_API_KEY is missing from .env. Voice synthesis will fail.")
-    else:
-        print("✅ ElevenLabs API Key detected.")
-        
-    asyncio.create_task(email_polling_task())
-
-@app.on_event("shutdown")
-async def shutdown_event():
-    print("👋 Server shutting down...")
+    try:
+        while True:
+            wake.clear()
+            try:
+                await asyncio.to_thread(_poll_and_send)
+            except Exception as e:
+                 pass
+                 
+            try:
+                await asyncio.wait_for(wake.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        # Cancelled from lifespan on shutdown: drop the channel and its websocket
+        if realtime_client is not None:
+            try:
+                await realtime_client.remove_all_channels()
+                await realtime_client.realtime.close()
+            except Exception as e:
+                print(f"⚠️ Realtime client close failed: {e}")
 
 if __name__ == "__main__":
     import uvicorn
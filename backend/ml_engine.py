@@ -24,6 +24,19 @@ y_train = [0, 0, 2, 2, 1, 2, 1]
 rf_model = RandomForestClassifier(n_estimators=100, random_state=42)
 rf_model.fit(X_train, y_train)
 
+# Markdown chars (*, #) and :, -, newline all become spaces in one translate pass
+_CLEAN_TABLE = str.maketrans({':': ' ', '-': ' ', '\n': ' ', '*': ' ', '#': ' '})
+
+# Vitals patterns, compiled once instead of on every parse
+_BP_RE = re.compile(r'(?:bp|pressure)?[^\d]*(\d{2,3})\s*/\s*(\d{2,3})')
+_SUGAR_RE = re.compile(r'(?:sugar|glucose|rbs|fbs|ppbs|levels?)[^\d]*(\d{2,3})')
+_HR_RE = re.compile(r'(?:hr|pulse|rate|bpm)[^\d]*(\d{2,3})')
+_AGE_RE = re.compile(r'(?:age|old)[^\d]*(\d{1,2})')
+_HEIGHT_RE = re.compile(r'(\d{2,3})\s*(?:cm|centimeters)')
+_WEIGHT_RE = re.compile(r'(\d{2,3})\s*(?:kg|kilograms)')
+_BLOOD_GROUP_RE = re.compile(r'\b(a|b|ab|o)\s?[\+\-]', re.IGNORECASE)
+_BLOOD_GROUP_WORD_RE = re.compile(r'\b(a|b|ab|o)\s+(positive|negative)')
+
 def parse_medical_text(text_data):
     """
     Extracts numerical vitals from unstructured text using Regex.
@@ -43,52 +56,52 @@ def parse_medical_text(text_data):
     
     # Pre-process text to simpler format
     # Remove markdown chars (*, #), replaces :, -, newline with space
-    clean_text = text_data.lower().replace(':', ' ').replace('-', ' ').replace('\n', ' ').replace('*', ' ').replace('#', ' ')
+    clean_text = text_data.lower().translate(_CLEAN_TABLE)
     
     # DEBUG: Print text snippet to see what we are parsing
     print(f"🔍 Parsing Text Snippet: {clean_text[:200]}...")
 
     # Extract BP (e.g., "150/90", "140 / 90", "bp 120/80")
     # Look for 2-3 digits / 2-3 digits. Ignore non-digits in between.
-    bp_match = re.search(r'(?:bp|pressure)?[^\d]*(\d{2,3})\s*/\s*(\d{2,3})', clean_text)
+    bp_match = _BP_RE.search(clean_text)
     if bp_match:
         data['systolic'] = int(bp_match.group(1))
         data['diastolic'] = int(bp_match.group(2))
 
     # Extract Sugar (e.g., "sugar 200", "glucose 180", "rbs 140", "fbs 100")
-    sugar_match = re.search(r'(?:sugar|glucose|rbs|fbs|ppbs|levels?)[^\d]*(\d{2,3})', clean_text)
+    sugar_match = _SUGAR_RE.search(clean_text)
     if sugar_match:
         data['sugar'] = int(sugar_match.group(1))
 
     # Extract Heart Rate (e.g., "HR 80", "pulse 100", "bpm 90")
-    hr_match = re.search(r'(?:hr|pulse|rate|bpm)[^\d]*(\d{2,3})', clean_text)
+    hr_match = _HR_RE.search(clean_text)
     if hr_match:
         data['heart_rate'] = int(hr_match.group(1))
 
     # Extract Age (e.g., "25 years", "age 30", "30 yrs", "Age: 35")
     # Matches "age" followed by ANY non-digits, then the number.
-    age_match = re.search(r'(?:age|old)[^\d]*(\d{1,2})', clean_text)
+    age_match = _AGE_RE.search(clean_text)
     if age_match:
         data['age'] = int(age_match.group(1))
 
     # Extract Height (e.g., "175 cm")
-    height_match = re.search(r'(\d{2,3})\s*(?:cm|centimeters)', clean_text)
+    height_match = _HEIGHT_RE.search(clean_text)
     if height_match:
         data['height'] = int(height_match.group(1))
 
     # Extract Weight (e.g., "70 kg")
-    weight_match = re.search(r'(\d{2,3})\s*(?:kg|kilograms)', clean_text)
+    weight_match = _WEIGHT_RE.search(clean_text)
     if weight_match:
         data['weight'] = int(weight_match.group(1))
         
     # Extract Blood Group (A+, B-, AB+, O+, etc)
     # Using case insensitive original text for this one to preserve case if needed (though we lowercased above)
-    bg_match = re.search(r'\b(a|b|ab|o)\s?[\+\-]', text_data, re.IGNORECASE)
+    bg_match = _BLOOD_GROUP_RE.search(text_data)
     if bg_match:
         data['blood_group'] = bg_match.group(0).upper().replace(' ', '')
     else:
         # Try full words like "O Positive"
-        bg_word_match = re.search(r'\b(a|b|ab|o)\s+(positive|negative)', clean_text)
+        bg_word_match = _BLOOD_GROUP_WORD_RE.search(clean_text)
         if bg_word_match:
             grp = bg_word_match.group(1).upper()
             sign = "+" if "positive" in bg_word_match.group(2) else "-"
@@ -285,14 +285,22 @@ class PharmacyService:
             # 1. Check Standard Orders (only if UUID)
             is_uuid = len(patient_id) == 36 and patient_id.count('-') == 4
             if is_uuid:
+                # Newest first, bounded: older orders have long since run out and
+                # contribute nothing to the next-`days_ahead` window. DESC sorts
+                # NULLs first, so unstamped orders are excluded from the window.
                 response = self.supabase.table("orders")\
-                    .select("*, order_items(*, medicines(name, stock))")\
+                    .select("finalized_at, order_items(medicine_id, days_supply, medicines(name))")\
                     .eq("patient_id", patient_id)\
                     .eq("status", "finalized")\
+                    .not_.is_("finalized_at", "null")\
+                    .order("finalized_at", desc=True)\
+                    .limit(200)\
                     .execute()
                 
                 if response.data:
                     for order in response.data:
+                        if not order.get("finalized_at"):
+                            continue
                         finalized_at = datetime.fromisoformat(order["finalized_at"].replace('Z', '+00:00'))
                         for item in order["order_items"]:
                             med_name = item["medicines"]["name"]
@@ -312,8 +320,10 @@ class PharmacyService:
 
             # 2. Check Raw History
             raw_response = self.supabase.table("order_history_raw")\
-                .select("*")\
+                .select("product_name, purchase_date")\
                 .eq("patient_external_id", patient_id)\
+                .order("purchase_date", desc=True)\
+                .limit(200)\
                 .execute()
             
             if raw_response.data:
@@ -1,11 +1,21 @@
 import google.generativeai as genai
 from supabase import create_client, Client
+import asyncio
 import requests
-import io
-import PyPDF2
+import json
+import hashlib
+import fitz  # PyMuPDF
 from typing import List, Optional
+from cachetools import TTLCache
 from langfuse.decorators import observe
 
+_EMBEDDING_CACHE_LOOKUP_BATCH = 100
+
+_EXTRACT_PROMPT = (
+    "Extract all the text from this document. If there is handwriting, transcribe it accurately. "
+    "If there are tables or forms, structure them clearly as text."
+)
+
 class RAGService:
     """
     Service for handling Retrieval Augmented Generation (RAG)
@@ -14,6 +24,9 @@ class RAGService:
     
     def __init__(self, supabase_url: str, supabase_key: str):
         self.supabase: Client = create_client(supabase_url, supabase_key)
+        self.vision_model = genai.GenerativeModel('gemini-2.5-flash')
+        # Top-K chunk selections per (user, query, k); records rarely change within 10 min
+        self._relevant_cache: TTLCache = TTLCache(maxsize=512, ttl=600)
     
     @observe()
     async def search_records(
@@ -36,21 +49,23 @@ class RAGService:
             Formatted context text from matched records
         """
         try:
-            # Generate embedding for query
-            query_embedding = genai.embed_content(
+            # Generate embedding for query (SDK calls block, so run them in a thread)
+            embed_result = await asyncio.to_thread(
+                genai.embed_content,
                 model="models/gemini-embedding-001",
                 content=query,
                 task_type="retrieval_query",
                 output_dimensionality=768
-            )['embedding']
+            )
+            query_embedding = embed_result['embedding']
             
             # Search vector database
-            response = self.supabase.rpc('match_document_chunks', {
+            response = await asyncio.to_thread(self.supabase.rpc('match_document_chunks', {
                 'query_embedding': query_embedding,
                 'match_threshold': match_threshold,
                 'match_count': match_count,
                 'filter_user_id': user_id
-            }).execute()
+            }).execute)
             
             # Format results
             if response.data:
@@ -65,6 +80,46 @@ class RAGService:
             print(f"❌ RAG Search Error: {e}")
             return ""
     
+    async def get_relevant_records(self, user_id: str, query: str, k: int = 5) -> List[str]:
+        """
+        Get the k record chunks most similar to a query (for prompt building)
+        
+        Args:
+            user_id: Patient ID
+            query: Text describing what the chunks should cover
+            k: Number of chunks to return
+            
+        Returns:
+            Chunk texts, best match first ([] if the patient has no chunks)
+        """
+        cache_key = (user_id, query, k)
+        cached = self._relevant_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        try:
+            embed_result = await asyncio.to_thread(
+                genai.embed_content,
+                model="models/gemini-embedding-001",
+                content=query,
+                task_type="retrieval_query",
+                output_dimensionality=768
+            )
+            # No similarity floor: we want the k best chunks, however weak
+            response = await asyncio.to_thread(self.supabase.rpc('match_document_chunks', {
+                'query_embedding': embed_result['embedding'],
+                'match_threshold': 0.0,
+                'match_count': k,
+                'filter_user_id': user_id
+            }).execute)
+        except Exception as e:
+            print(f"❌ Relevant Records Error: {e}")
+            return []
+        
+        chunks = [item['content'] for item in response.data or [] if item.get('content')]
+        self._relevant_cache[cache_key] = chunks
+        return chunks
+    
     @observe()
     async def process_document(
         self,
@@ -85,6 +140,19 @@ class RAGService:
         Returns:
             Dictionary with processing results
         """
+        # Download, OCR, embedding and inserts are all blocking calls
+        return await asyncio.to_thread(
+            self._process_document_sync, file_url, record_id, patient_id, chunk_size
+        )
+    
+    def _process_document_sync(
+        self,
+        file_url: str,
+        record_id: str,
+        patient_id: str,
+        chunk_size: int
+    ) -> dict:
+        """Blocking implementation of process_document"""
         try:
             print(f"📥 Downloading file from: {file_url}")
             
@@ -94,26 +162,52 @@ class RAGService:
             content_type = response.headers.get('Content-Type', '').lower()
             
             full_text = ""
+            chunks = []
             
             if 'pdf' in content_type.lower() or 'image/' in content_type or file_url.lower().endswith(('.png', '.jpg', '.jpeg', '.pdf')):
-                print(f"🖼️ Processing Document via Vision Model (MIME: {content_type})...")
                 mime_type = 'application/pdf'
                 if 'png' in content_type.lower() or file_url.lower().endswith('.png'):
                     mime_type = 'image/png'
                 elif 'jpg' in content_type.lower() or 'jpeg' in content_type.lower() or file_url.lower().endswith(('.jpg', '.jpeg')):
                     mime_type = 'image/jpeg'
                 
-                vision_model = genai.GenerativeModel('gemini-2.5-flash')
-                try:
-                    vision_response = vision_model.generate_content([
-                        "Extract all the text from this document. If there is handwriting, transcribe it accurately. If there are tables or forms, structure them clearly as text. Return ONLY the extracted text. If no text is found, return an empty string.",
-                        {'mime_type': mime_type, 'data': response.content}
-                    ])
-                    full_text = vision_response.text
-                    print(f"✅ Extracted {len(full_text)} characters from document")
-                except Exception as ve:
-                    print(f"❌ AI Extraction failed: {ve}")
-                    raise ValueError(f"AI Document Extraction failed: {ve}")
+                # Digital PDFs carry a text layer; read it locally and skip the Vision call
+                if mime_type == 'application/pdf':
+                    full_text = self._extract_pdf_text(response.content)
+                    if full_text:
+                        print(f"✅ Extracted {len(full_text)} characters from PDF text layer")
+                
+                if not full_text:
+                    print(f"🖼️ Processing Document via Vision Model (MIME: {content_type})...")
+                    try:
+                        # One call does OCR and segmentation: the model returns the text
+                        # already split at sentence boundaries, ready for embedding
+                        document = {'mime_type': mime_type, 'data': response.content}
+                        vision_response = self.vision_model.generate_content(
+                            [
+                                _EXTRACT_PROMPT + " "
+                                f'Output JSON: {{"chunks": ["...", "..."]}} where each chunk is ~{chunk_size} characters, split at sentence boundaries, and the chunks in order contain the complete extracted text. '
+                                'If no text is found, return {"chunks": []}.',
+                                document
+                            ],
+                            generation_config={"response_mime_type": "application/json"}
+                        )
+                        chunks = self._parse_chunks(vision_response.text)
+                        if chunks is None:
+                            # Usually a long scan cut off at the output-token limit: never store
+                            # the partial JSON as text, re-extract as plain text and chunk it below
+                            chunks = []
+                            plain_response = self.vision_model.generate_content([
+                                _EXTRACT_PROMPT + " Return ONLY the extracted text. If no text is found, return an empty string.",
+                                document
+                            ])
+                            full_text = plain_response.text
+                        else:
+                            full_text = "\n".join(chunks)
+                        print(f"✅ Extracted {len(full_text)} characters in {len(chunks)} chunks from document")
+                    except Exception as ve:
+                        print(f"❌ AI Extraction failed: {ve}")
+                        raise ValueError(f"AI Document Extraction failed: {ve}")
             else:
                 # Fallback purely as safety
                 raise ValueError(f"Unsupported file type: {content_type}")
@@ -130,30 +224,26 @@ class RAGService:
             except Exception as e:
                 print(f"⚠️ Could not save full text: {e}")
             
-            # Create chunks
-            chunks = [
-                full_text[i:i+chunk_size] 
-                for i in range(0, len(full_text), chunk_size)
-            ]
+            # Create chunks (text-layer PDFs; Vision output arrives pre-chunked)
+            if not chunks:
+                chunks = [
+                    full_text[i:i+chunk_size] 
+                    for i in range(0, len(full_text), chunk_size)
+                ]
             
             print(f"📄 Created {len(chunks)} chunks, generating embeddings...")
             
             # Generate embeddings and prepare for batch insert
-            rows_to_insert = []
-            for chunk in chunks:
-                embedding_result = genai.embed_content(
-                    model="models/gemini-embedding-001",
-                    content=chunk,
-                    task_type="retrieval_document",
-                    output_dimensionality=768
-                )
-                
-                rows_to_insert.append({
+            embeddings = self._embed_chunks(chunks)
+            rows_to_insert = [
+                {
                     "record_id": record_id,
                     "patient_id": patient_id,
                     "content": chunk,
-                    "embedding": embedding_result['embedding']
-                })
+                    "embedding": embedding
+                }
+                for chunk, embedding in zip(chunks, embeddings)
+            ]
             
             # Batch insert to database
             if rows_to_insert:
@@ -169,6 +259,96 @@ class RAGService:
             print(f"❌ Document Processing Error: {e}")
             raise
     
+    def _extract_pdf_text(self, data: bytes, min_chars: int = 200) -> str:
+        """
+        Extract the embedded text layer of a PDF locally
+        
+        Args:
+            data: Raw PDF bytes
+            min_chars: Below this, treat the PDF as scanned and return ""
+            
+        Returns:
+            Extracted text, or "" if the PDF has no usable text layer
+        """
+        try:
+            with fitz.open(stream=data, filetype="pdf") as doc:
+                text = "\n".join(page.get_text("text") for page in doc)
+        except Exception as e:
+            print(f"⚠️ Local PDF extraction failed: {e}")
+            return ""
+        
+        return text if len(text.strip()) >= min_chars else ""
+    
+    def _parse_chunks(self, raw: str) -> Optional[List[str]]:
+        """
+        Parse the Vision model's {"chunks": [...]} output
+        
+        Args:
+            raw: Model response text
+            
+        Returns:
+            Non-empty chunks, or None if the output is not chunk JSON
+        """
+        try:
+            chunks = json.loads(raw)["chunks"]
+            return [c for c in chunks if isinstance(c, str) and c.strip()]
+        except (ValueError, KeyError, TypeError):
+            print("⚠️ Vision output was not chunk JSON, re-extracting as plain text")
+            return None
+    
+    def _embed_chunks(self, chunks: List[str]) -> List[list]:
+        """
+        Embed chunks, reusing cached embeddings for identical chunk text
+        
+        Args:
+            chunks: Text chunks to embed
+            
+        Returns:
+            Embeddings in the same order as chunks
+        """
+        hashes = [
+            hashlib.blake2b(chunk.encode(), digest_size=16).hexdigest()
+            for chunk in chunks
+        ]
+        
+        # The IN list goes in the query string (~33 bytes per hash): look up in
+        # batches so long documents stay under URL length limits
+        cached = {}
+        unique_hashes = list(dict.fromkeys(hashes))
+        for i in range(0, len(unique_hashes), _EMBEDDING_CACHE_LOOKUP_BATCH):
+            try:
+                response = self.supabase.table("chunk_embedding_cache")\
+                    .select("content_hash, embedding")\
+                    .in_("content_hash", unique_hashes[i:i + _EMBEDDING_CACHE_LOOKUP_BATCH])\
+                    .execute()
+                cached.update((row["content_hash"], row["embedding"]) for row in response.data or [])
+            except Exception as e:
+                print(f"⚠️ Embedding cache lookup failed: {e}")
+        
+        misses = {}
+        for chunk, h in zip(chunks, hashes):
+            if h in cached or h in misses:
+                continue
+            misses[h] = genai.embed_content(
+                model="models/gemini-embedding-001",
+                content=chunk,
+                task_type="retrieval_document",
+                output_dimensionality=768
+            )['embedding']
+        
+        print(f"🧠 Embeddings: {len(chunks) - len(misses)} cached, {len(misses)} generated")
+        
+        if misses:
+            try:
+                self.supabase.table("chunk_embedding_cache").upsert([
+                    {"content_hash": h, "embedding": embedding}
+                    for h, embedding in misses.items()
+                ]).execute()
+            except Exception as e:
+                print(f"⚠️ Could not update embedding cache: {e}")
+        
+        return [cached.get(h) or misses[h] for h in hashes]
+    
     async def get_patient_records(self, user_id: str) -> List[str]:
         """
         Get all text records for a patient (for health analysis)
@@ -182,10 +362,12 @@ class RAGService:
         try:
             # Try document_chunks first
             print(f"🔍 Fetching chunks for user: {user_id}")
-            response = self.supabase.table('document_chunks')\
-                .select('content')\
-                .eq('patient_id', user_id)\
-                .execute()
+            response = await asyncio.to_thread(
+                self.supabase.table('document_chunks')
+                .select('content')
+                .eq('patient_id', user_id)
+                .execute
+            )
             
             if response.data:
                 print(f"✅ Found {len(response.data)} chunks")
@@ -196,10 +378,12 @@ class RAGService:
             print("⚠️ No chunks found, trying records fallback...")
             
             # Fallback to records.extracted_text
-            fallback = self.supabase.table('records')\
-                .select('extracted_text')\
-                .eq('patient_id', user_id)\
-                .execute()
+            fallback = await asyncio.to_thread(
+                self.supabase.table('records')
+                .select('extracted_text')
+                .eq('patient_id', user_id)
+                .execute
+            )
             
             if fallback.data:
                 print(f"✅ Found {len(fallback.data)} records in fallback")
@@ -218,11 +402,13 @@ class RAGService:
         """
         try:
             # Fetch from records table to get original documents with dates
-            response = self.supabase.table('records')\
-                .select('created_at, extracted_text')\
-                .eq('patient_id', user_id)\
-                .order('created_at', desc=False)\
-                .execute()
+            response = await asyncio.to_thread(
+                self.supabase.table('records')
+                .select('created_at, extracted_text')
+                .eq('patient_id', user_id)
+                .order('created_at', desc=False)
+                .execute
+            )
             
             if response.data:
                 return [
@@ -1,6 +1,10 @@
 from elevenlabs import ElevenLabs, VoiceSettings
+import asyncio
+import httpx
 import re
-from typing import Optional
+from typing import AsyncIterator, Optional
+
+ELEVENLABS_STREAM_URL = "https://api.elevenlabs.io/v1/text-to-speech/{voice_id}/stream"
 
 class VoiceService:
     """
@@ -8,7 +12,9 @@ class VoiceService:
     """
     
     def __init__(self, api_key: str):
+        self.api_key = api_key
         self.client = ElevenLabs(api_key=api_key)
+        self._http: Optional[httpx.AsyncClient] = None  # created on first stream, then reused
         
         # Voice IDs for different languages and emotions
         self.voices = {
@@ -77,19 +83,19 @@ class VoiceService:
             
             print(f"🎤 Synthesizing voice (lang: {language}, length: {len(clean_text)} chars)")
             
-            # Generate audio with streaming for faster response
-            audio_generator = self.client.text_to_speech.convert(
-                voice_id=voice_id,
-                text=clean_text,
-                model_id="eleven_turbo_v2_5",  # Using Turbo v2.5 for extreme low latency + highest naturalness
-                voice_settings=self.empathic_settings,
-            )
+            def _convert() -> bytes:
+                # Generate audio with streaming for faster response
+                audio_generator = self.client.text_to_speech.convert(
+                    voice_id=voice_id,
+                    text=clean_text,
+                    model_id="eleven_turbo_v2_5",  # Using Turbo v2.5 for extreme low latency + highest naturalness
+                    voice_settings=self.empathic_settings,
+                )
+                # Collect audio chunks
+                return b"".join(chunk for chunk in audio_generator if chunk)
             
-            # Collect audio chunks
-            audio_data = b""
-            for chunk in audio_generator:
-                if chunk:
-                    audio_data += chunk
+            # The ElevenLabs client is synchronous; keep it off the event loop
+            audio_data = await asyncio.to_thread(_convert)
             
             print(f"✅ Voice generated: {len(audio_data)} bytes")
             return audio_data
@@ -103,6 +109,59 @@ class VoiceService:
                 pass
             return None
     
+    async def synthesize_empathic_stream(
+        self,
+        text: str,
+        language: str = "en"
+    ) -> AsyncIterator[bytes]:
+        """
+        Stream empathic speech from ElevenLabs as it is generated
+        
+        Args:
+            text: Text to convert to speech
+            language: Language code (en, hi)
+            
+        Yields:
+            MP3 audio chunks; nothing if there is no text left after cleaning
+        """
+        clean_text = self._clean_text_for_speech(text)
+        if not clean_text:
+            print("⚠️ No text to synthesize after cleaning")
+            return
+        
+        voice_id = self.voices.get(language, self.voices["en"])
+        settings = self.empathic_settings
+        
+        if self._http is None:
+            self._http = httpx.AsyncClient(timeout=httpx.Timeout(30.0, connect=5.0))
+        
+        print(f"🎤 Streaming voice (lang: {language}, length: {len(clean_text)} chars)")
+        async with self._http.stream(
+            "POST",
+            ELEVENLABS_STREAM_URL.format(voice_id=voice_id),
+            headers={"xi-api-key": self.api_key, "Accept": "audio/mpeg"},
+            json={
+                "text": clean_text,
+                "model_id": "eleven_turbo_v2_5",
+                "voice_settings": {
+                    "stability": settings.stability,
+                    "similarity_boost": settings.similarity_boost,
+                    "style": settings.style,
+                    "use_speaker_boost": settings.use_speaker_boost,
+                },
+            },
+        ) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes():
+                if chunk:
+                    yield chunk
+    
+    async def aclose(self) -> None:
+        """Close the streaming HTTP client (called on app shutdown)"""
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+    
     async def synthesize_streaming(
         self,
         text: str,
@@ -1,3 +1,6 @@
+from itertools import islice
+
+import orjson
 import pandas as pd
 from supabase import create_client
 
@@ -10,11 +13,9 @@ PASSWORD = "HealthChainDemo2026!"
 def migrate_35_patients():
     # Load your CSV
     df = pd.read_csv("Consumer Order History 1.xlsx - Sheet1.csv")
-    unique_ids = df['patient_external_id'].unique()[:35]
 
-    for ext_id in unique_ids:
-        # Filter data for this specific patient
-        patient_rows = df[df['patient_external_id'] == ext_id]
+    # One pass splits the rows per patient (first 35 patients, in file order)
+    for ext_id, patient_rows in islice(df.groupby('patient_external_id', sort=False), 35):
         email = f"patient_{ext_id}@demo.com"
         
         try:
@@ -44,7 +45,10 @@ def migrate_35_patients():
 
             # STEP D: Insert into 'records' (The missing data fix)
             # We convert their CSV rows into a text block for the Gemini Agent
-            history_text = patient_rows.to_string(index=False)
+            history_text = orjson.dumps(
+                patient_rows.to_dict(orient='records'),
+                option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY,
+            ).decode()
             
             supabase.table("records").insert({
                 "patient_id": internal_patient_id, # Correct link to patients table
@@ -56,15 +60,12 @@ def migrate_35_patients():
             }).execute()
 
             # STEP E: Insert into 'order_history_raw' for the ML Engine
-            raw_orders = []
-            for _, row in patient_rows.iterrows():
-                raw_orders.append({
-                    "patient_external_id": str(ext_id),
-                    "product_name": row['product_name'],
-                    "quantity": int(row['quantity']),
-                    "purchase_date": row['purchase_date'],
-                    "total_price_eur": float(row['total_price_eur'])
-                })
+            raw_orders = (
+                patient_rows[['product_name', 'quantity', 'purchase_date', 'total_price_eur']]
+                .astype({'quantity': int, 'total_price_eur': float})
+                .assign(patient_external_id=str(ext_id))
+                .to_dict(orient='records')
+            )
             supabase.table("order_history_raw").insert(raw_orders).execute()
 
             print(f"✅ Success: {email} | Records Linked to ID: {internal_patient_id}")
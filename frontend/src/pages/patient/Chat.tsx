@@ -189,34 +189,65 @@ export function Chat() {
     }
   }
 
-  const playBase64Audio = (base64Data: string) => {
+  const playAudioSrc = (src: string, onFinish?: () => void) => {
     try {
       if (currentAudio) {
         currentAudio.pause();
         currentAudio.src = "";
       }
 
-      const audio = new Audio(`data:audio/mp3;base64,${base64Data}`);
+      const audio = new Audio(src);
       setCurrentAudio(audio);
 
       audio.onplay = () => setIsSpeaking(true);
       audio.onended = () => {
         setIsSpeaking(false);
         setCurrentAudio(null);
+        onFinish?.();
       };
       audio.onerror = (e) => {
         console.error("Audio playback error:", e);
         setIsSpeaking(false);
         setCurrentAudio(null);
+        onFinish?.();
       };
 
-      audio.play();
+      audio.play().catch(() => {});
     } catch (error) {
-      console.error("Failed to play base64 audio:", error);
+      console.error("Failed to play audio:", error);
       setIsSpeaking(false);
     }
   };
 
+  const playBase64Audio = (base64Data: string) => {
+    playAudioSrc(`data:audio/mp3;base64,${base64Data}`);
+  };
+
+  // Feed the MP3 stream into a MediaSource so playback starts with the first chunk
+  const playAudioStream = async (body: ReadableStream<Uint8Array>) => {
+    const mediaSource = new MediaSource();
+    const url = URL.createObjectURL(mediaSource);
+    playAudioSrc(url, () => URL.revokeObjectURL(url));
+
+    await new Promise(resolve => mediaSource.addEventListener('sourceopen', resolve, { once: true }));
+    const sourceBuffer = mediaSource.addSourceBuffer('audio/mpeg');
+    const appended = () => new Promise(resolve => sourceBuffer.addEventListener('updateend', resolve, { once: true }));
+
+    const reader = body.getReader();
+    try {
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        if (mediaSource.readyState !== 'open') return; // playback was stopped
+        sourceBuffer.appendBuffer(value as BufferSource);
+        await appended();
+      }
+      if (mediaSource.readyState === 'open') mediaSource.endOfStream();
+    } finally {
+      reader.cancel().catch(() => {});
+    }
+  };
+
   const stopSpeaking = () => {
     if (currentAudio) {
       currentAudio.pause();
@@ -277,6 +308,34 @@ export function Chat() {
     setMessages(prev => [...prev, newMessage])
   }
 
+  const updateMessage = (id: string, text: string) => {
+    setMessages(prev => prev.map(m => (m.id === id ? { ...m, text } : m)))
+  }
+
+  const playSynthesizedVoice = async (text: string) => {
+    try {
+      const response = await fetch(`${API_BASE_URL}/synthesize_voice`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ text, language: i18n.language || 'en' }),
+      })
+      if (!response.ok || !response.body) throw new Error(`Voice synthesis failed: ${response.status}`)
+
+      if ('MediaSource' in window && MediaSource.isTypeSupported('audio/mpeg')) {
+        // Once audio is playing, a broken stream just ends playback early
+        playAudioStream(response.body).catch(err => console.warn('Voice stream interrupted:', err))
+        return
+      }
+
+      // No MSE support for MP3 (e.g. iOS Safari): play once fully downloaded
+      const url = URL.createObjectURL(await response.blob())
+      playAudioSrc(url, () => URL.revokeObjectURL(url))
+    } catch (error) {
+      console.warn('High-quality voice unavailable, using browser speech:', error)
+      speakText(text)
+    }
+  }
+
   const handleSendMessage = async (overrideText?: string) => {
     stopListening()
     const textToSend = overrideText || inputValue
@@ -290,7 +349,7 @@ export function Chat() {
     setIsLoading(true)
 
     try {
-      const response = await fetch(`${API_BASE_URL}/chat`, {
+      const response = await fetch(`${API_BASE_URL}/chat/stream`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
@@ -298,17 +357,53 @@ export function Chat() {
           language: i18n.language || 'en',
           user_id: user?.id,
           use_records: useRecords,
-          use_voice: true, // Always request high-quality audio
         }),
       })
+      if (!response.ok || !response.body) throw new Error(`HTTP ${response.status}`)
+
+      // Render tokens as Server-Sent Events arrive instead of waiting for the full answer
+      const botId = `${Date.now()}-bot`
+      const reader = response.body.getReader()
+      const decoder = new TextDecoder()
+      let buffer = ''
+      let fullText = ''
+      let streamError: string | null = null
+
+      while (true) {
+        const { done, value } = await reader.read()
+        if (done) break
+        buffer += decoder.decode(value, { stream: true })
+
+        const events = buffer.split('\n\n')
+        buffer = events.pop() || ''
+        for (const event of events) {
+          if (!event.startsWith('data: ')) continue
+          const payload = JSON.parse(event.slice(6))
+          if (payload.delta) {
+            if (!fullText) {
+              setMessages(prev => [
+                ...prev,
+                {
+                  id: botId,
+                  text: '',
+                  isUser: false,
+                  timestamp: new Date().toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' }),
+                },
+              ])
+              setIsLoading(false)
+            }
+            fullText += payload.delta
+            updateMessage(botId, fullText)
+          } else if (payload.error) {
+            streamError = payload.error
+          }
+        }
+      }
 
-      const result = await response.json()
-
-      if (result.success) {
-        addMessage(result.response, false)
-        speakText(result.response, result.audio_data)
-      } else {
-        addMessage(`⚠️ ${result.error}`, false)
+      if (streamError && !fullText) {
+        addMessage(`⚠️ ${streamError}`, false)
+      } else if (fullText) {
+        playSynthesizedVoice(fullText)
       }
     } catch (error) {
       addMessage('❌ Connection Error: Ensure the Python AI server is running.', false)
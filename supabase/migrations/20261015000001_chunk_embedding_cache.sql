@@ -0,0 +1,13 @@
+-- Content-addressed cache of document chunk embeddings.
+-- Keyed by blake2b(chunk text) so boilerplate shared across records
+-- (letterheads, disclaimers, lab templates) is embedded only once.
+create extension if not exists vector;
+
+create table if not exists public.chunk_embedding_cache (
+  content_hash text primary key,
+  embedding vector(768) not null,
+  created_at timestamptz default now()
+);
+
+-- Service-role only: no policies, so anon/authenticated clients cannot read it.
+alter table public.chunk_embedding_cache enable row level security;
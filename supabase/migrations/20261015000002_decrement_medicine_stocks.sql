@@ -0,0 +1,19 @@
+-- Batched stock decrement: one RPC call for a whole order instead of one per item.
+-- p_items: [{"id": "<medicine uuid>", "qty": <int>}, ...]
+create or replace function public.decrement_medicine_stocks(p_items jsonb)
+returns void as $$
+declare
+  rec record;
+begin
+  for rec in select * from jsonb_to_recordset(p_items) as x(id uuid, qty integer)
+  loop
+    update public.medicines
+    set stock = stock - rec.qty
+    where id = rec.id;
+  end loop;
+end;
+$$ language plpgsql security definer
+set search_path = public;
+
+-- Service-role only: the backend calls this; the public anon key must not.
+revoke execute on function public.decrement_medicine_stocks(jsonb) from public, anon, authenticated;
@@ -0,0 +1,30 @@
+-- Create a manual order in one transactional RPC: insert the order already
+-- fulfilled, insert its items and decrement stock. Returns the new order id.
+-- p_items: [{"medicine_id": "<uuid>", "qty": <int>, "dosage_text": <text>, "frequency_per_day": <int|null>}, ...]
+create or replace function public.create_manual_order(p_patient_id uuid, p_items jsonb)
+returns uuid as $$
+declare
+  v_order_id uuid;
+begin
+  insert into public.orders (patient_id, status, total_items, channel, finalized_at)
+  select p_patient_id, 'fulfilled', coalesce(sum(x.qty), 0), 'web', now()
+  from jsonb_to_recordset(p_items) as x(qty integer)
+  returning id into v_order_id;
+
+  insert into public.order_items (order_id, medicine_id, qty, dosage_text, frequency_per_day, days_supply)
+  select v_order_id, x.medicine_id, x.qty, x.dosage_text, x.frequency_per_day, 30
+  from jsonb_to_recordset(p_items)
+    as x(medicine_id uuid, qty integer, dosage_text text, frequency_per_day integer);
+
+  perform public.decrement_medicine_stocks(
+    (select jsonb_agg(jsonb_build_object('id', x.medicine_id, 'qty', x.qty))
+     from jsonb_to_recordset(p_items) as x(medicine_id uuid, qty integer))
+  );
+
+  return v_order_id;
+end;
+$$ language plpgsql security definer
+set search_path = public;
+
+-- Service-role only: the backend calls this; the public anon key must not.
+revoke execute on function public.create_manual_order(uuid, jsonb) from public, anon, authenticated;
@@ -0,0 +1,6 @@
+-- Trigram index so prescription lookups can filter extracted_text with ILIKE '%name%'
+-- in Postgres instead of shipping every OCR blob to the backend.
+create extension if not exists pg_trgm;
+
+create index if not exists idx_records_extracted_text_trgm
+  on public.records using gin (extracted_text gin_trgm_ops);
@@ -0,0 +1,17 @@
+-- Scheduler dose window: decrement every active scheduled order item in one statement.
+-- p_window_index: 1, 2 or 3 (08:00, 14:00, 20:00 IST); items taken fewer times a day are skipped.
+create or replace function public.auto_decrement_doses(p_window_index integer)
+returns table (id uuid) as $$
+  update public.order_items oi
+  set qty = greatest(0, oi.qty - 1)
+  from public.orders o
+  where oi.order_id = o.id
+    and o.status in ('fulfilled', 'approved')
+    and oi.frequency_per_day >= p_window_index
+    and oi.qty > 0
+  returning oi.id;
+$$ language sql security definer
+set search_path = public;
+
+-- Service-role only: the backend calls this; the public anon key must not.
+revoke execute on function public.auto_decrement_doses(integer) from public, anon, authenticated;
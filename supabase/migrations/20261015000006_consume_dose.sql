@@ -0,0 +1,19 @@
+-- "Taken" button: atomically decrement one owned order item with units left.
+-- Returns the remaining qty, or null if the item is missing, not owned by
+-- p_patient_auth_uid, or already at 0.
+create or replace function public.consume_dose(p_patient_auth_uid uuid, p_item_id uuid)
+returns integer as $$
+  update public.order_items oi
+  set qty = oi.qty - 1
+  from public.orders o
+  join public.patients p on p.id = o.patient_id
+  where oi.id = p_item_id
+    and oi.order_id = o.id
+    and p.user_id = p_patient_auth_uid
+    and oi.qty > 0
+  returning oi.qty;
+$$ language sql security definer
+set search_path = public;
+
+-- Service-role only: the backend calls this; the public anon key must not.
+revoke execute on function public.consume_dose(uuid, uuid) from public, anon, authenticated;
@@ -0,0 +1,12 @@
+-- Email alert worker: the pending-email scan only touches pending rows,
+-- and new rows are pushed to the backend over Supabase Realtime.
+create index if not exists idx_notification_logs_pending_email
+  on public.notification_logs (id)
+  where status = 'pending' and channel = 'email';
+
+do $$
+begin
+  alter publication supabase_realtime add table public.notification_logs;
+exception
+  when duplicate_object then null;
+end $$;
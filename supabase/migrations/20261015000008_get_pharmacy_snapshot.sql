@@ -0,0 +1,9 @@
+-- Pharmacist copilot header: aggregate counts in Postgres instead of
+-- shipping every medicines/orders row to the backend to count them.
+create or replace function public.get_pharmacy_snapshot()
+returns json as $$
+  select json_build_object(
+    'inventory_count', (select count(*) from public.medicines),
+    'pending_count', (select count(*) from public.orders where status = 'pending')
+  );
+$$ language sql stable security definer;
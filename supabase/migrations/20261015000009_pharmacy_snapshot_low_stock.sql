@@ -0,0 +1,23 @@
+-- Pharmacist copilot header: add a bounded low-stock list to the snapshot
+-- so the prompt stays constant-size however large the inventory grows.
+-- Items are ranked by how far below their reorder threshold they sit.
+create or replace function public.get_pharmacy_snapshot()
+returns json as $$
+  select json_build_object(
+    'inventory_count', (select count(*) from public.medicines),
+    'pending_count', (select count(*) from public.orders where status = 'pending'),
+    'low_stock_count', (
+      select count(*) from public.medicines
+      where stock <= coalesce(reorder_threshold, 10)
+    ),
+    'low_stock', (
+      select coalesce(json_agg(t), '[]'::json) from (
+        select name, stock, coalesce(reorder_threshold, 10) as threshold
+        from public.medicines
+        where stock <= coalesce(reorder_threshold, 10)
+        order by stock::numeric / greatest(coalesce(reorder_threshold, 10), 1)
+        limit 20
+      ) t
+    )
+  );
+$$ language sql stable security definer;
@@ -0,0 +1,29 @@
+-- Pharmacist copilot header: total historical revenue summed in Postgres,
+-- so revenue questions don't pull every order_history_raw row to the backend.
+create or replace function public.get_pharmacy_snapshot()
+returns json as $$
+  select json_build_object(
+    'inventory_count', (select count(*) from public.medicines),
+    'pending_count', (select count(*) from public.orders where status = 'pending'),
+    'low_stock_count', (
+      select count(*) from public.medicines
+      where stock <= coalesce(reorder_threshold, 10)
+    ),
+    'low_stock', (
+      select coalesce(json_agg(t), '[]'::json) from (
+        select name, stock, coalesce(reorder_threshold, 10) as threshold
+        from public.medicines
+        where stock <= coalesce(reorder_threshold, 10)
+        order by stock::numeric / greatest(coalesce(reorder_threshold, 10), 1)
+        limit 20
+      ) t
+    ),
+    'total_revenue', (
+      select coalesce(sum(total_price_eur::numeric), 0) from public.order_history_raw
+    )
+  );
+$$ language sql stable security definer
+set search_path = public;
+
+-- Service-role only: the backend calls this; the public anon key must not.
+revoke execute on function public.get_pharmacy_snapshot() from public, anon, authenticated;